@@ -24,6 +24,7 @@ def CIRCLE_WORLD(world_size:int=400, verbosity:int=1, **kwargs):
                      dynamics=UtilityOrderedSwapper(kwargs['swap_cond'] if 'swap_cond' in kwargs else INDIVIDUAL_NO_WORSE),
                      init_func=kwargs['grid_init'] if 'grid_init' in kwargs else random_init,
                      init_rand_seed=kwargs['init_rand_seed'] if 'init_rand_seed' in kwargs else -1,
+                     history_size=kwargs['history_size'] if 'history_size' in kwargs else 0,
                      verbosity=verbosity)
 
 
@@ -38,6 +39,7 @@ def CYLINDER_WORLD(world_size:int=200, verbosity:int=1, **kwargs):
                      dynamics=UtilityOrderedSwapper(kwargs['swap_cond'] if 'swap_cond' in kwargs else INDIVIDUAL_NO_WORSE),
                      init_func=kwargs['grid_init'] if 'grid_init' in kwargs else random_init,
                      init_rand_seed=kwargs['init_rand_seed'] if 'init_rand_seed' in kwargs else -1,
+                     history_size=kwargs['history_size'] if 'history_size' in kwargs else 0,
                      verbosity=verbosity)
 
 
@@ -52,6 +54,7 @@ def GRID_4DEG_WORLD(world_size:list=[20,20], verbosity:int=1, **kwargs):
                      dynamics=UtilityOrderedSwapper(kwargs['swap_cond'] if 'swap_cond' in kwargs else INDIVIDUAL_NO_WORSE),
                      init_func=kwargs['grid_init'] if 'grid_init' in kwargs else random_init,
                      init_rand_seed=kwargs['init_rand_seed'] if 'init_rand_seed' in kwargs else -1,
+                     history_size=kwargs['history_size'] if 'history_size' in kwargs else 0,
                      verbosity=verbosity)
 
 
@@ -66,4 +69,5 @@ def GRID_8DEG_WORLD(world_size:list=[20,20], verbosity:int=1, **kwargs):
                      dynamics=UtilityOrderedSwapper(kwargs['swap_cond'] if 'swap_cond' in kwargs else INDIVIDUAL_NO_WORSE),
                      init_func=kwargs['grid_init'] if 'grid_init' in kwargs else random_init,
                      init_rand_seed=kwargs['init_rand_seed'] if 'init_rand_seed' in kwargs else -1,
+                     history_size=kwargs['history_size'] if 'history_size' in kwargs else 0,
                      verbosity=verbosity)
\ No newline at end of file
@@ -16,8 +16,8 @@ class DynamicsOutput:
         Output for dynamics for the vectors that moved
 
         Args:
-            past_locations: list of past locations indices
-            new_locations: list of new locations indices
+            past_locations: np.array of past flat location ids
+            new_locations: np.array of new flat location ids
             is_end: True if there is no more moves to make
     '''
     past_locations: list = None
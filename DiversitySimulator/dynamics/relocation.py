@@ -0,0 +1,163 @@
+from __future__ import annotations
+import numpy as np
+
+from dynamics.base_dynamic import BaseDynamics, DynamicsOutput
+from graph_envs.base_graph_env import _gather_csr_rows
+from utilities.base_utility import EMPTY
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from graph_envs.base_graph_env import BaseGraphEnvironment
+
+'''
+    Schelling-style relocation: vertices move to the empty locations (type EMPTY) of the world.
+'''
+
+BEST_VACANCY = 'best'
+FIRST_VACANCY = 'first'
+
+
+class VacancySet:
+    '''
+        Set of the flat location ids of the vacancies,
+        with O(1) add, remove and uniform sampling.
+        The ids are kept packed in `ids`, and `_positions[loc_id]` is the position
+        of loc_id in `ids` (-1 if it is not a vacancy).
+    '''
+    def __init__(self, num_vertices: int, loc_ids: np.ndarray = None):
+        '''
+            Args:
+                num_vertices: number of vertices in the world
+                loc_ids: (optional) np.array of the initial vacancies
+        '''
+        self._ids = np.zeros(0 if loc_ids is None else len(loc_ids), dtype=np.int64)
+        self._positions = np.full(num_vertices, -1, dtype=np.int64)
+        self._size = 0
+        if loc_ids is not None:
+            for loc_id in loc_ids:
+                self.add(int(loc_id))
+
+    @property
+    def ids(self):
+        '''
+            np.array view of the vacancies (it must not be modified by the caller).
+        '''
+        return self._ids[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, loc_id: int):
+        return self._positions[loc_id] >= 0
+
+    def add(self, loc_id: int):
+        if loc_id in self:
+            return
+        if self._size == len(self._ids):
+            self._ids = np.concatenate([self._ids, np.zeros(max(1, self._size), dtype=np.int64)])
+        self._ids[self._size] = loc_id
+        self._positions[loc_id] = self._size
+        self._size += 1
+
+    def remove(self, loc_id: int):
+        '''
+            Remove a vacancy by moving the last vacancy to its position.
+        '''
+        position = self._positions[loc_id]
+        if position < 0:
+            return
+        last_id = self._ids[self._size-1]
+        self._ids[position] = last_id
+        self._positions[last_id] = position
+        self._positions[loc_id] = -1
+        self._size -= 1
+
+    def sample(self, rng: np.random.Generator):
+        return int(self._ids[rng.integers(self._size)])
+
+
+class Relocator(BaseDynamics):
+    '''
+        Move an unhappy vertex to a vacancy that improves its utility.
+
+        At each step, the unhappy vertices (utility below `threshold`) are tried in random order,
+        and the first one with an improving vacancy moves to the best one (the one with
+        the highest utility, the smallest location id on ties) or to the first one in
+        the vacancy set order. The run ends when no unhappy vertex can improve.
+        All the vacancies are scored at once for the moving vertex from the placement utility matrix.
+    '''
+    def __init__(self, policy:str=BEST_VACANCY, threshold:float=np.inf, seed:int=None):
+        '''
+            Args:
+                policy: BEST_VACANCY or FIRST_VACANCY
+                threshold: (optional) the vertices with a utility below threshold are unhappy
+                           by default, all the vertices are
+                seed: (optional) seed of the Generator ordering the vertices
+        '''
+        if policy not in [BEST_VACANCY, FIRST_VACANCY]:
+            raise ValueError('Unknown relocation policy: %s' % policy)
+        self.policy = policy
+        self.threshold = threshold
+        self._rng = np.random.default_rng(seed)
+        self._vacancies = None
+        self._world = None
+
+    def _get_vacancies(self, env: BaseGraphEnvironment):
+        '''
+            Get the vacancy set, built again if the world was changed by something else than this dynamic.
+        '''
+        if (self._vacancies is None or self._world is not env.world
+                or np.any(env.get_vertex_types(self._vacancies.ids) != EMPTY)):
+            types = env.get_vertex_types(np.arange(env.num_vertices))
+            self._vacancies = VacancySet(env.num_vertices, np.flatnonzero(types == EMPTY))
+            self._world = env.world
+        return self._vacancies
+
+    def _choose_vacancy(self, env: BaseGraphEnvironment, loc_id: int, utility: float):
+        '''
+            Return:
+                the flat id of the vacancy loc_id moves to, None if no vacancy is improving
+        '''
+        vacancy_ids = self._vacancies.ids
+        new_utilities, _ = env.compute_swap_utilities(np.full(len(vacancy_ids), loc_id), vacancy_ids)
+        is_improving = new_utilities > utility
+        if not np.any(is_improving):
+            return None
+        if self.policy == FIRST_VACANCY:
+            return int(vacancy_ids[np.argmax(is_improving)])
+        is_best = new_utilities == np.max(new_utilities[is_improving])
+        return int(np.min(vacancy_ids[is_best]))
+
+    def step(self, env: BaseGraphEnvironment):
+        vacancies = self._get_vacancies(env)
+        if len(vacancies) == 0:
+            return self.end_response()
+        placement_utility_matrix = env.get_placement_utility_matrix()
+        types = env.get_vertex_types(np.arange(env.num_vertices))
+        loc_ids = np.flatnonzero(types != EMPTY)
+        utilities = placement_utility_matrix[loc_ids, types[loc_ids]]
+        is_unhappy = utilities < self.threshold
+        loc_ids, utilities = loc_ids[is_unhappy], utilities[is_unhappy]
+
+        # a vertex can only improve if it is below the best utility of its type at a vacancy, 
+        # or if it is in the neighbourhood of a vacancy (so that moving changes the vacancy's counts)
+        best_utilities = np.fmax.reduce(placement_utility_matrix[vacancies.ids], axis=0)
+        is_candidate = utilities < best_utilities[types[loc_ids]]
+        _, neigh_ids = _gather_csr_rows(*env._get_neighbourhood(), vacancies.ids)
+        is_neighbour = np.zeros(env.num_vertices, dtype=bool)
+        is_neighbour[neigh_ids] = True
+        is_candidate |= is_neighbour[loc_ids]
+        order = self._rng.permutation(len(loc_ids))
+        for k in order[is_candidate[order]].tolist():
+            vacancy_id = self._choose_vacancy(env, int(loc_ids[k]), utilities[k])
+            if vacancy_id is not None:
+                vacancies.remove(vacancy_id)
+                vacancies.add(int(loc_ids[k]))
+                # a relocation is a swap with the vacancy
+                loc_ids = np.array([loc_ids[k], vacancy_id], dtype=np.int64)
+                return DynamicsOutput(
+                    past_locations=loc_ids,
+                    new_locations=loc_ids[::-1],
+                    is_end=False
+                )
+        return self.end_response()
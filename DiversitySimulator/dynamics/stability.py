@@ -0,0 +1,46 @@
+from __future__ import annotations
+import copy
+import numpy as np
+
+from dynamics.swap import RandomSwapper
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from graph_envs.base_graph_env import BaseGraphEnvironment
+
+'''
+    Stability certificates: a world is stable for a swap condition 
+    (an equilibrium) if no pair of vertices can swap.
+'''
+
+
+def find_improving_swap(env: BaseGraphEnvironment, swap_condition: int, world: np.ndarray|list = None):
+    '''
+        Find a pair of vertices that can swap under the swap condition, 
+        or prove that there is none (see `BaseSwapper._find_improving_swap`).
+        It takes O(N T log N) time on a stable world of N vertices and T types,
+        except under COLLECTIVE_GREATER, which checks all the pairs in O(N^2) time.
+
+        Args:
+            env: the simulator object, for the graph, the number of types and the utility
+            swap_condition: the swap condition
+            world: (optional) the type assignment to check instead of env.world, 
+                   e.g. a `final_world` of the results (env is not modified)
+
+        Return:
+            (loc_id1, loc_id2) flat location ids, or None if the world is stable
+    '''
+    if world is not None:
+        env = copy.copy(env)
+        # keep the world of the copy in memory, not in the files of env
+        env.memmap_dir = None
+        env.world = np.array(world).reshape(env.world.shape)
+    return RandomSwapper(swap_condition)._find_improving_swap(env)
+
+
+def is_stable(env: BaseGraphEnvironment, swap_condition: int, world: np.ndarray|list = None):
+    '''
+        True if no pair of vertices can swap under the swap condition (see `find_improving_swap`:
+        quadratic in the number of vertices under COLLECTIVE_GREATER).
+    '''
+    return find_improving_swap(env, swap_condition, world) is None
@@ -1,8 +1,12 @@
 from __future__ import annotations
+from math import comb
 import numpy as np
+import scipy.ndimage
 
 from dynamics.base_dynamic import BaseDynamics, DynamicsOutput
-from graph_envs.base_graph_env import Vertex
+from graph_envs.base_graph_env import Vertex, _gather_csr_rows, _CHUNK_SIZE
+from utilities.base_utility import EMPTY
+from utilities.lookup_table import get_compositions
 
 from typing import TYPE_CHECKING, Any
 if TYPE_CHECKING:   
@@ -39,31 +43,244 @@ class BaseSwapper(BaseDynamics):
                                 env: BaseGraphEnvironment,
                                 u1:Any=None,
                                 u2:Any=None):
-        
-        v12 = Vertex(loc_idx=v2.loc_idx, type=v1.type)
-        v21 = Vertex(loc_idx=v1.loc_idx, type=v2.type)
-
         if u1 is None:
             u1 = env.compute_utility(v1)
         if u2 is None:
             u2 = env.compute_utility(v2)
-        env.move_vertices(self._swap(v1, v2))
-        u12 = env.compute_utility(v12)
-        u21 = env.compute_utility(v21)
-        env.move_vertices(self._swap(v12, v21))
+        u12, u21 = env.compute_swap_utilities([v1.loc_idx], [v2.loc_idx])
+        u12, u21 = u12[0], u21[0]
 
         if env.verbosity==2:
             print('Swapping', v1, 'and', v2)
             print('Old utilities:', u1, u2, '-> New utilities:', u12, u21)
+        return bool(self._is_improving(u1, u2, u12, u21))
 
-        can_swap = False
+    def _is_improving(self, u1: Any, u2: Any, u12: Any, u21: Any):
+        '''
+            Pairwise swap condition on the utilities before (u1, u2) and after (u12, u21) the swap,
+            element-wise if they are np.arrays.
+        '''
         if self.swap_condition == INDIVIDUAL_NO_WORSE:
-            can_swap = (u12 >= u1) and (u21 >= u2) and (u12 + u21) > (u1 + u2) 
+            return (u12 >= u1) & (u21 >= u2) & ((u12 + u21) > (u1 + u2))
         elif self.swap_condition == SUM_GREATER:
-            can_swap = (u12 + u21) > (u1 + u2)
-        else: # swap_condition == INDIVIDUAL_GREATER
-            can_swap = (u12 > u1) and (u21 > u2)
-        return can_swap
+            return (u12 + u21) > (u1 + u2)
+        # swap_condition == INDIVIDUAL_GREATER
+        return (u12 > u1) & (u21 > u2)
+
+    def _get_utilities(self, env: BaseGraphEnvironment, loc_ids: np.ndarray):
+        '''
+            Utilities of the vertices at loc_ids, read from the placement utility matrix
+            (NaN for the EMPTY locations, as in `BaseUtility.compute_block`).
+        '''
+        loc_ids = np.asarray(loc_ids, dtype=np.int64)
+        types = env.get_vertex_types(loc_ids)
+        utilities = env.get_placement_utility_matrix()[loc_ids, types]
+        return np.where(types != EMPTY, utilities, np.nan)
+
+    def _accepted_swaps(self, 
+                        env: BaseGraphEnvironment, 
+                        loc_ids1: np.ndarray, 
+                        loc_ids2: np.ndarray):
+        '''
+            Evaluate the swap condition on many pairs at once.
+            Pairs of the same type are never swapped.
+
+            Return:
+                np.array of bool, one for each pair
+        '''
+        types1 = env.get_vertex_types(loc_ids1)
+        types2 = env.get_vertex_types(loc_ids2)
+        is_accepted = types1 != types2
+        pairs = np.flatnonzero(is_accepted)
+        if self.swap_condition == COLLECTIVE_GREATER:
+            is_accepted[pairs] = self._collective_accepted_swaps(env, loc_ids1[pairs], loc_ids2[pairs])
+            return is_accepted
+        loc_ids1, loc_ids2 = loc_ids1[pairs], loc_ids2[pairs]
+        u1 = self._get_utilities(env, loc_ids1)
+        u2 = self._get_utilities(env, loc_ids2)
+        u12, u21 = env.compute_swap_utilities(loc_ids1, loc_ids2)
+        is_accepted[pairs] = self._is_improving(u1, u2, u12, u21)
+        return is_accepted
+
+    def _get_dependent_ids(self, env: BaseGraphEnvironment, loc_ids: np.ndarray):
+        '''
+            Get the vertices whose swaps may be evaluated differently 
+            after the types at loc_ids change.
+        '''
+        affected = env.get_affected_ids(loc_ids)
+        if self.swap_condition == COLLECTIVE_GREATER:
+            # the condition also depends on the immediate neighbours of the pair
+            _, neigh_ids = _gather_csr_rows(env.neighbour_indptr, env.neighbour_indices, affected)
+            affected = np.union1d(affected, neigh_ids)
+        return affected
+
+    def _improving_partners(self, 
+                            env: BaseGraphEnvironment, 
+                            loc_id: int, 
+                            partner_ids: np.ndarray,
+                            u1:Any=None,
+                            u2:np.ndarray=None):
+        '''
+            Find which of the partners the vertex at loc_id can swap with
+            under the pairwise swap condition, all at once.
+
+            Args:
+                env: the simulator object
+                loc_id: flat location id of the vertex
+                partner_ids: np.array of flat location ids of the candidate partners
+                u1: (optional) utility of the vertex
+                u2: (optional) np.array of utilities of the partners
+
+            Return:
+                np.array of bool, one for each partner
+        '''
+        if self.swap_condition == COLLECTIVE_GREATER:
+            return self._collective_accepted_swaps(env, np.full(len(partner_ids), loc_id), partner_ids)
+        if u1 is None or u2 is None:
+            u1 = self._get_utilities(env, [loc_id])[0]
+            u2 = self._get_utilities(env, partner_ids)
+        u12, u21 = env.compute_swap_utilities(np.full(len(partner_ids), loc_id), partner_ids)
+        return self._is_improving(u1, u2, u12, u21)
+
+    def _find_improving_swap(self, env: BaseGraphEnvironment, start: int = 0):
+        '''
+            Find a pair of vertices that can swap, or prove that there is none.
+
+            The neighbouring pairs are evaluated exactly. For the other pairs, the utilities 
+            after the swap are read from the placement utility matrix P, so for each pair of 
+            types (a, b) the swap condition becomes a query over the vertices of each type:
+            - individual conditions: is there i of type a and j of type b with u_i < P[j, a] 
+              and P[i, b] > u_j (or the non-strict variants for INDIVIDUAL_NO_WORSE)? 
+              It is answered by a prefix max of P[i, b] over the vertices i sorted by u_i.
+            - SUM_GREATER: is there i, j with (P[i, b] - u_i) + (P[j, a] - u_j) > 0? 
+              It is answered by the largest P[i, b] - u_i among the vertices not neighbouring j.
+            The candidate pairs found by the queries are then checked exactly. 
+            This takes O(N T log N) time on a stable world. COLLECTIVE_GREATER depends on the 
+            neighbours of both vertices, which the queries cannot capture: it checks all the pairs, 
+            vertex by vertex, in O(N^2) time (a few seconds for 10^3 vertices, 
+            and 100 times longer for each 10 times more vertices).
+
+            Args:
+                env: the simulator object
+                start: (optional) under COLLECTIVE_GREATER, the vertex to start from 
+                       (the scan wraps around)
+
+            Return:
+                (loc_id1, loc_id2), or None if no pair satisfies the swap condition
+        '''
+        if self.swap_condition == COLLECTIVE_GREATER:
+            num_rows = env.num_vertices - 1
+            for loc_id in ((start + k) % num_rows for k in range(num_rows)):
+                partner_ids = np.arange(loc_id + 1, env.num_vertices)
+                is_accepted = self._accepted_swaps(env, np.full(len(partner_ids), loc_id), partner_ids)
+                if np.any(is_accepted):
+                    return (loc_id, int(partner_ids[np.argmax(is_accepted)]))
+            return None
+
+        neigh_ids1, neigh_ids2 = env.get_neighbourhood_pairs()
+        is_pair = neigh_ids1 < neigh_ids2
+        is_accepted = self._accepted_swaps(env, neigh_ids1[is_pair], neigh_ids2[is_pair])
+        if np.any(is_accepted):
+            k = np.argmax(is_accepted)
+            return (int(neigh_ids1[is_pair][k]), int(neigh_ids2[is_pair][k]))
+        # sorted keys of the neighbouring pairs, in both orders
+        neigh_keys = neigh_ids1 * env.num_vertices + neigh_ids2
+        max_neighbours = int(np.max(np.bincount(neigh_ids1, minlength=env.num_vertices), initial=0))
+
+        def _is_neighbour(loc_ids1, loc_ids2):
+            keys = loc_ids1 * env.num_vertices + loc_ids2
+            positions = np.minimum(np.searchsorted(neigh_keys, keys), max(len(neigh_keys)-1, 0))
+            return (len(neigh_keys) > 0) & (neigh_keys[positions] == keys)
+
+        placement_utility_matrix = env.get_placement_utility_matrix()
+        types = env.get_vertex_types(np.arange(env.num_vertices))
+        utilities = self._get_utilities(env, np.arange(env.num_vertices))
+        finite = np.abs(placement_utility_matrix[np.isfinite(placement_utility_matrix)])
+        # bound on the rounding error of the rearranged sum of gains
+        tol = 16 * np.finfo(float).eps * (np.max(finite, initial=0) + 1)
+        loc_ids_by_type = [np.flatnonzero(types == t) for t in range(env.num_types)]
+        for t1 in range(env.num_types):
+            for t2 in range(t1+1, env.num_types):
+                ids1, ids2 = loc_ids_by_type[t1], loc_ids_by_type[t2]
+                if len(ids1) == 0 or len(ids2) == 0:
+                    continue
+                u1, u21 = utilities[ids1], placement_utility_matrix[ids1, t2]
+                u2, u12 = utilities[ids2], placement_utility_matrix[ids2, t1]
+
+                # candidates: positions in ids2 and, for each, the position in ids1 of its best partner
+                if self.swap_condition == SUM_GREATER:
+                    gains1 = np.nan_to_num(u21 - u1, nan=-np.inf)
+                    order = np.argsort(-gains1, kind='stable')[:max_neighbours+1]
+                    is_free = ~_is_neighbour(ids1[order][None, :], ids2[:, None])
+                    best = order[np.argmax(is_free, axis=1)]
+                    is_candidate = np.any(is_free, axis=1) & (gains1[best] + (u12 - u2) > -tol)
+                    candidates, best = np.flatnonzero(is_candidate), best[is_candidate]
+                else:
+                    queries = [('left', np.greater)]
+                    if self.swap_condition == INDIVIDUAL_NO_WORSE:
+                        queries = [('left', np.greater_equal), ('right', np.greater)]
+                    order = np.argsort(u1, kind='stable')
+                    prefix_u21 = np.maximum.accumulate(np.nan_to_num(u21[order], nan=-np.inf))
+                    prefix_best = np.maximum.accumulate(
+                        np.where(np.nan_to_num(u21[order], nan=-np.inf) == prefix_u21, np.arange(len(order)), 0))
+                    is_candidate = np.zeros(len(ids2), dtype=bool)
+                    best = np.zeros(len(ids2), dtype=np.int64)
+                    for side, compare in queries:
+                        # the vertices i with u_i below (or equal to) P[j, a] are a prefix of order
+                        num_below = np.where(np.isnan(u12), 0, np.searchsorted(u1[order], u12, side=side))
+                        is_found = (num_below > 0) & compare(prefix_u21[num_below-1], u2)
+                        best[is_found & ~is_candidate] = order[prefix_best[num_below-1]][is_found & ~is_candidate]
+                        is_candidate |= is_found
+                    candidates, best = np.flatnonzero(is_candidate), best[is_candidate]
+                if len(candidates) == 0:
+                    continue
+
+                is_valid = ~_is_neighbour(ids1[best], ids2[candidates]) & self._is_improving(
+                    u1[best], u2[candidates], u12[candidates], u21[best])
+                if np.any(is_valid):
+                    k = np.argmax(is_valid)
+                    return (int(ids1[best[k]]), int(ids2[candidates[k]]))
+                # the best partner is a neighbour (or a tie within rounding): check the other partners.
+                # The swap condition only depends on (u_i, P[i, b]) for a partner i, so it is checked 
+                # once for each class of partners with the same values, over the classes that can 
+                # pass the query above, and then on the first max_neighbours+1 vertices of the 
+                # classes satisfying it (at least one of them is not a neighbour).
+                keys = np.nan_to_num(np.stack([u1, u21]), nan=-np.inf)
+                _, first, inverse = np.unique(keys, axis=1, return_index=True, return_inverse=True)
+                class_sizes = np.bincount(inverse.reshape(-1), minlength=len(first))
+                members = np.argsort(inverse.reshape(-1), kind='stable')
+                ranks = np.arange(len(members)) - np.repeat(np.cumsum(class_sizes) - class_sizes, class_sizes)
+                members = members[ranks <= max_neighbours]
+                members_indptr = np.concatenate([[0], np.cumsum(np.minimum(class_sizes, max_neighbours+1))])
+                class_u1, class_u21 = u1[first], u21[first]
+                if self.swap_condition == SUM_GREATER:
+                    class_gains = np.nan_to_num(class_u21 - class_u1, nan=-np.inf)
+                    class_order = np.argsort(-class_gains, kind='stable')
+                    num_classes = np.searchsorted(-class_gains[class_order], 
+                                                  np.nan_to_num(u12 - u2, nan=-np.inf)[candidates] + tol)
+                else:
+                    class_order = np.argsort(class_u1, kind='stable')
+                    side = 'right' if self.swap_condition == INDIVIDUAL_NO_WORSE else 'left'
+                    num_classes = np.where(np.isnan(u12[candidates]), 0, 
+                                           np.searchsorted(class_u1[class_order], u12[candidates], side=side))
+                # by blocks of candidates, with about _CHUNK_SIZE (candidate, class) pairs each
+                ends = np.cumsum(num_classes)
+                start = 0
+                while start < len(candidates):
+                    stop = max(start+1, int(np.searchsorted(ends, ends[start] - num_classes[start] + _CHUNK_SIZE, 
+                                                            side='right')))
+                    lengths = num_classes[start:stop]
+                    owner = np.repeat(candidates[start:stop], lengths)
+                    classes = class_order[np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)]
+                    is_found = self._is_improving(class_u1[classes], u2[owner], u12[owner], class_u21[classes])
+                    owner, classes = owner[is_found], classes[is_found]
+                    positions, partners = _gather_csr_rows(members_indptr, members, classes)
+                    is_valid = ~_is_neighbour(ids1[partners], ids2[owner[positions]])
+                    if np.any(is_valid):
+                        k = np.argmax(is_valid)
+                        return (int(ids1[partners[k]]), int(ids2[owner[positions[k]]]))
+                    start = stop
+        return None
 
     def _collective_wise_swap_condition(self, 
                                         v1: Vertex, 
@@ -71,29 +288,46 @@ class BaseSwapper(BaseDynamics):
                                         env: BaseGraphEnvironment,
                                         u1:Any=None,
                                         u2:Any=None):
-        
-        def _get_all_neighbour_utilities(v, u=None):
-            neigh = env.get_immediate_neighbours(v)
-            if u is None:
-                u = env.compute_utility(v)
-            return u, [env.compute_utility(n) for n in neigh]
-
-        u1, nu1 = _get_all_neighbour_utilities(v1, u1)
-        u2, nu2 = _get_all_neighbour_utilities(v2, u2)
-
-        v12 = Vertex(loc_idx=v2.loc_idx, type=v1.type)
-        v21 = Vertex(loc_idx=v1.loc_idx, type=v2.type)
-        env.move_vertices(self._swap(v1, v2))
-        u12, nu12 = _get_all_neighbour_utilities(v12)
-        u21, nu21 = _get_all_neighbour_utilities(v21)
+        return bool(self._collective_accepted_swaps(env, [v1.loc_idx], [v2.loc_idx])[0])
+
+    def _collective_accepted_swaps(self, 
+                                   env: BaseGraphEnvironment, 
+                                   loc_ids1: np.ndarray, 
+                                   loc_ids2: np.ndarray):
+        '''
+            Collective swap condition on many pairs at once: each of the two vertices can move 
+            if the majority of itself and its occupied immediate neighbours is better off after the swap 
+            (a vacancy has no utility, so it is never better off).
+            Only the utilities of the two vertices and of their immediate neighbours
+            are computed, before and after the swap.
 
+            Return:
+                np.array of bool, one for each pair
+        '''
+        loc_ids1 = np.asarray(loc_ids1, dtype=np.int64)
+        loc_ids2 = np.asarray(loc_ids2, dtype=np.int64)
+        u12, u21 = env.compute_swap_utilities(loc_ids1, loc_ids2)
+
+        def _get_scores(loc_ids, u, u_swapped):
+            # the vertices moving out of loc_ids and their current occupied neighbours
+            # that are better off after the swap (the vacancies do not vote)
+            owner, neigh_ids = _gather_csr_rows(env.neighbour_indptr, env.neighbour_indices, loc_ids)
+            is_occupied = env.get_vertex_types(neigh_ids) != EMPTY
+            owner, neigh_ids = owner[is_occupied], neigh_ids[is_occupied]
+            neigh_u = self._get_utilities(env, neigh_ids)
+            neigh_u_swapped = env.utility.compute_block(
+                env.get_swapped_vertex_block(loc_ids1[owner], loc_ids2[owner], neigh_ids))
+            scores = (u < u_swapped) + np.bincount(owner, weights=neigh_u < neigh_u_swapped, 
+                                                   minlength=len(loc_ids))
+            return scores, np.bincount(owner, minlength=len(loc_ids))
+
+        u1 = self._get_utilities(env, loc_ids1)
+        u2 = self._get_utilities(env, loc_ids2)
         # If the majority of the people, including myself, want me to move
         # Then I can move.
-        score1, score2 = int(u1 < u12), int(u2 < u21)
-        for i in range(len(nu1)):
-            score1 += int(nu1[i] < nu21[i]) 
-            score2 += int(nu2[i] < nu12[i])
-        return score1 >= (len(nu1)+1)/2 and score2 >= (len(nu2)+1)/2
+        score1, degree1 = _get_scores(loc_ids1, u1, u12)
+        score2, degree2 = _get_scores(loc_ids2, u2, u21)
+        return (score1 >= (degree1+1)/2) & (score2 >= (degree2+1)/2)
 
     def _can_swap(self, 
                    v1: Vertex, 
@@ -111,37 +345,553 @@ class BaseSwapper(BaseDynamics):
             return self._pairwise_swap_condition(v1, v2, env, u1, u2)
 
     def _swap(self, v1: Vertex, v2: Vertex):
-        loc_idx_list = [v1.loc_idx, v2.loc_idx]
+        loc_ids = np.array([v1.loc_idx, v2.loc_idx], dtype=np.int64)
         return DynamicsOutput(
-            past_locations=loc_idx_list,
-            new_locations=loc_idx_list[::-1],
+            past_locations=loc_ids,
+            new_locations=loc_ids[::-1],
             is_end=False
         )
 
 
 class RandomSwapper(BaseSwapper):
     '''
-        Randomly select a pair of vertices and swap them if both of their utilities can 
+        Randomly select a pair of vertices and swap them if both of their utilities can.
+
+        With `batch_size`, the candidate pairs are drawn batch_size at a time from a 
+        NumPy Generator and evaluated all at once. They are then taken in order, and the 
+        pairs touched by an accepted swap are evaluated again on the new world first, 
+        so the trajectory is the same as sampling the pairs one by one.
+        Each step returns the next accepted swap, or None if the batch is exhausted.
+
+        With `rejection_free`, the number of pairs each vertex can swap with is kept up to date,
+        and each step directly samples a uniform pair among the pairs that can swap 
+        (or ends the run if there are none). The number of rejected pairs a sequential
+        sampler would have drawn before it is drawn from a geometric distribution.
+        The counts take the N(N-1) ordered pairs evaluated once, and each step evaluates again 
+        the |D| N pairs of the |D| vertices depending on the swapped locations, so this mode 
+        is meant for small worlds (up to about 10^4 vertices: the first step takes a few seconds 
+        on a 60x60 grid); use batch_size on larger ones.
+
+        In both modes, `num_rejections` is the number of pairs rejected before the last accepted swap.
+
+        With `check_every`, every check_every steps, the run ends if no pair can swap at all
+        (see `dynamics.stability`).
     '''
+    def __init__(self, 
+                 swap_condition:int=0, 
+                 batch_size:int=None, 
+                 seed:int=None, 
+                 rejection_free:bool=False,
+                 check_every:int=None):
+        '''
+            Args:
+                swap_condition: the swap condition
+                batch_size: (optional) number of candidate pairs drawn at a time
+                            if None, draw one pair per step with `env.sample_vertices`
+                seed: (optional) seed of the Generator used in batched and rejection-free mode
+                rejection_free: (optional) sample directly among the pairs that can swap
+                check_every: (optional) number of steps between two stability checks
+        '''
+        super().__init__(swap_condition)
+        self.batch_size = batch_size
+        self.rejection_free = rejection_free
+        self.num_rejections = 0
+        self._rng = np.random.default_rng(seed)
+        self._proposals = None
+        self._rejections = 0
+        self._partner_counts = None
+        self.check_every = check_every
+        self._num_steps = 0
+
     def step(self, env: BaseGraphEnvironment):
+        if self.check_every is not None:
+            self._num_steps += 1
+            if self._num_steps % self.check_every == 0 and self._find_improving_swap(env) is None:
+                return self.end_response()
+        if self.rejection_free:
+            return self._rejection_free_step(env)
+        if self.batch_size is not None:
+            return self._batch_step(env)
         samples = env.sample_vertices(2)
         if self._can_swap(samples[0], samples[1], env):
             return self._swap(samples[0], samples[1])
         return None
 
+    def _rejection_free_step(self, env: BaseGraphEnvironment):
+        if not self._update_partner_counts(env):
+            self._env_state = (env.get_neighborhood_type_matrix(), env.utility)
+            self._partner_counts = self._count_partners(env)
+        self._last_swap = None
+        total = int(np.sum(self._partner_counts))
+        if total == 0:
+            return self.end_response()
+        num_pairs = env.num_vertices * (env.num_vertices-1)
+        self.num_rejections = int(self._rng.geometric(total / num_pairs)) - 1
+
+        # a uniform (ordered) pair among the pairs that can swap
+        loc_id1 = int(np.searchsorted(np.cumsum(self._partner_counts), self._rng.integers(total), side='right'))
+        partners = np.flatnonzero(self._get_partners(env, np.array([loc_id1]))[0])
+        loc_id2 = int(partners[self._rng.integers(len(partners))])
+        loc_ids = np.array([loc_id1, loc_id2])
+        types = env.get_vertex_types(loc_ids)
+        self._last_swap = (loc_ids, types[::-1])
+        dependent = self._get_dependent_ids(env, loc_ids)
+        self._old_partners = (dependent, self._get_partners(env, dependent))
+        return self._swap(Vertex(loc_idx=loc_id1, type=int(types[0])), 
+                          Vertex(loc_idx=loc_id2, type=int(types[1])))
+
+    def _get_partners(self, env: BaseGraphEnvironment, loc_ids: np.ndarray, chunk_size: int = 2**20):
+        '''
+            Get which vertices each vertex at loc_ids can swap with.
+
+            Return:
+                np.array of bool of shape (len(loc_ids), num_vertices)
+        '''
+        all_ids = np.arange(env.num_vertices)
+        partners = np.zeros((len(loc_ids), env.num_vertices), dtype=bool)
+        num_rows = max(1, chunk_size // env.num_vertices)
+        for start in range(0, len(loc_ids), num_rows):
+            rows = loc_ids[start:start+num_rows]
+            partners[start:start+len(rows)] = self._accepted_swaps(
+                env, np.repeat(rows, env.num_vertices), np.tile(all_ids, len(rows))).reshape(len(rows), -1)
+        return partners
+
+    def _count_partners(self, env: BaseGraphEnvironment, chunk_size: int = 2**20):
+        '''
+            Count the vertices each vertex can swap with.
+        '''
+        counts = np.zeros(env.num_vertices, dtype=np.int64)
+        num_rows = max(1, chunk_size // env.num_vertices)
+        for start in range(0, env.num_vertices, num_rows):
+            rows = np.arange(start, min(start+num_rows, env.num_vertices))
+            counts[rows] = np.sum(self._get_partners(env, rows, chunk_size), axis=1)
+        return counts
+
+    def _update_partner_counts(self, env: BaseGraphEnvironment):
+        '''
+            Update the partner counts after the last swap: the swap condition can only change 
+            for the pairs with a vertex depending on the swapped locations.
+
+            Return:
+                False if the environment changed in another way 
+                and the counts have to be computed again.
+        '''
+        if self._partner_counts is None or \
+            self._env_state[0] is not env.get_neighborhood_type_matrix() or \
+            self._env_state[1] is not env.utility:
+            return False
+        if self._last_swap is None:
+            return True
+        if np.any(env.get_vertex_types(self._last_swap[0]) != self._last_swap[1]):
+            return False
+        dependent, old_partners = self._old_partners
+        new_partners = self._get_partners(env, dependent)
+        self._partner_counts += np.sum(new_partners, axis=0) - np.sum(old_partners, axis=0)
+        self._partner_counts[dependent] = np.sum(new_partners, axis=1)
+        return True
+
+    def _batch_step(self, env: BaseGraphEnvironment):
+        if self._proposals is None or self._next_proposal == len(self._proposals):
+            self._draw_proposals(env)
+        else:
+            self._refresh_proposals(env)
+        accepted = np.flatnonzero(self._is_accepted[self._next_proposal:])
+        if len(accepted) == 0:
+            self._rejections += len(self._proposals) - self._next_proposal
+            self._next_proposal = len(self._proposals)
+            return None
+        k = self._next_proposal + accepted[0]
+        self.num_rejections = self._rejections + int(accepted[0])
+        self._rejections = 0
+        self._next_proposal = k+1
+        loc_ids = self._proposals[k]
+        types = env.get_vertex_types(loc_ids)
+        self._last_swap = (loc_ids, types[::-1])
+        return self._swap(Vertex(loc_idx=int(loc_ids[0]), type=int(types[0])), 
+                          Vertex(loc_idx=int(loc_ids[1]), type=int(types[1])))
+
+    def _draw_proposals(self, env: BaseGraphEnvironment):
+        '''
+            Draw batch_size pairs of distinct vertices uniformly and evaluate them.
+        '''
+        loc_ids1 = self._rng.integers(env.num_vertices, size=self.batch_size)
+        loc_ids2 = self._rng.integers(env.num_vertices-1, size=self.batch_size)
+        loc_ids2 += loc_ids2 >= loc_ids1
+        self._proposals = np.stack([loc_ids1, loc_ids2], axis=1)
+        self._next_proposal = 0
+        self._last_swap = None
+        self._env_state = (env.get_neighborhood_type_matrix(), env.utility)
+        self._is_accepted = self._accepted_swaps(env, loc_ids1, loc_ids2)
+
+    def _refresh_proposals(self, env: BaseGraphEnvironment):
+        '''
+            Evaluate again the remaining pairs touched by the last accepted swap, 
+            or all of them if the environment changed in another way.
+        '''
+        proposals = self._proposals[self._next_proposal:]
+        to_evaluate = np.arange(len(proposals))
+        if self._env_state[0] is env.get_neighborhood_type_matrix() and \
+            self._env_state[1] is env.utility and self._last_swap is not None and \
+            np.all(env.get_vertex_types(self._last_swap[0]) == self._last_swap[1]):
+            affected = self._get_dependent_ids(env, self._last_swap[0])
+            to_evaluate = np.flatnonzero(np.any(np.isin(proposals, affected), axis=1))
+        self._env_state = (env.get_neighborhood_type_matrix(), env.utility)
+        self._last_swap = None
+        if len(to_evaluate) > 0:
+            self._is_accepted[self._next_proposal + to_evaluate] = self._accepted_swaps(
+                env, proposals[to_evaluate, 0], proposals[to_evaluate, 1])
+
 
 class UtilityOrderedSwapper(BaseSwapper):
     '''
-        Iterate by priority based on the utility of the vertex
+        Iterate by priority based on the utility of the vertex.
+
+        The vertices are kept ordered by (utility, location id) across steps, 
+        and only the vertices affected by the last swap are re-evaluated and re-inserted. 
+        A vertex whose pairs with all the later vertices were invalid at some step
+        is only checked again against the vertices affected since then, 
+        so the first valid pair is the same as with a full scan of the ordered pairs.
     '''
+    def __init__(self, swap_condition:int=0, round_mode:bool=False):
+        '''
+            Args:
+                swap_condition: the swap condition
+                round_mode: (optional) instead of one swap per step, greedily take in the same order 
+                            the valid pairs that do not share a vertex or a neighbourhood 
+                            with the pairs already taken, and swap them all in one step
+        '''
+        super().__init__(swap_condition)
+        self.round_mode = round_mode
+        self._env_state = None
+
     def step(self, env: BaseGraphEnvironment):
-        util_vertex = [(v, env.compute_utility(v)) for v in env]
-        util_vertex.sort(key=lambda x: x[1])
-        for i in range(env.num_vertices-1):
-            for j in range(i+1, env.num_vertices):
-                if util_vertex[i][0].type == util_vertex[j][0].type:
-                    continue
-                if self._can_swap(util_vertex[i][0], util_vertex[j][0], env,
-                                   u1=util_vertex[i][1], u2=util_vertex[j][1]):
-                    return self._swap(util_vertex[i][0], util_vertex[j][0])
-        return self.end_response()
\ No newline at end of file
+        if not self._update_schedule(env):
+            self._reset_schedule(env)
+        self._pending_swap = None
+
+        num_vertices = env.num_vertices
+        order = self._order
+        types = env.get_vertex_types(order)
+        utilities = self._utilities[order]
+        checked_at = self._checked_at[order]
+        affected_at = self._affected_at[order]
+        is_dirty = checked_at < affected_at
+        is_candidate = np.ones(num_vertices, dtype=bool)
+        if self._utility_bounds is not None:
+            # vertices already at their best utility can not strictly improve
+            is_candidate = utilities < self._utility_bounds[types]
+
+        # per type, the last change among the later candidates of a different type
+        later_changes = np.full((env.num_types, num_vertices), -1, dtype=np.int64)
+        for t in range(env.num_types):
+            changes = np.where(is_candidate & (types != t), affected_at, -1)
+            later_changes[t, :-1] = np.maximum.accumulate(changes[::-1])[::-1][1:]
+        to_check = is_candidate & (is_dirty | (later_changes[types, np.arange(num_vertices)] > checked_at))
+        # positions whose pairs with all the later vertices are invalid
+        is_checked = ~to_check
+        # in round mode, positions sharing a neighbourhood with a pair already taken
+        is_blocked = np.zeros(num_vertices, dtype=bool)
+        positions = np.empty(num_vertices, dtype=np.int64)
+        positions[order] = np.arange(num_vertices)
+
+        pairs = []
+        for i in np.flatnonzero(to_check).tolist():
+            if is_blocked[i]:
+                continue
+            is_pair = is_candidate[i+1:] & (types[i+1:] != types[i])
+            if not is_dirty[i]:
+                is_pair &= affected_at[i+1:] > checked_at[i]
+            partners = np.flatnonzero(is_pair) + i+1
+            if len(partners) == 0:
+                is_checked[i] = True
+                continue
+            is_improving = self._improving_partners(env, order[i], order[partners], 
+                                                    u1=utilities[i], u2=utilities[partners])
+            if not np.any(is_improving):
+                is_checked[i] = True
+                continue
+            is_improving &= ~is_blocked[partners]
+            if not np.any(is_improving):
+                continue
+            j = partners[np.argmax(is_improving)]
+            pairs.append((i, j))
+            if not self.round_mode:
+                is_checked[i:] = False
+                break
+            is_blocked[positions[self._get_dependent_ids(env, order[[i, j]])]] = True
+        self._checked_at[order[is_checked]] = self._num_swaps
+
+        if len(pairs) == 0:
+            return self.end_response()
+        if not self.round_mode:
+            i, j = pairs[0]
+            v1 = Vertex(loc_idx=int(order[i]), type=int(types[i]))
+            v2 = Vertex(loc_idx=int(order[j]), type=int(types[j]))
+            self._pending_swap = (np.array([v1.loc_idx, v2.loc_idx]), 
+                                  np.array([v2.type, v1.type]))
+            return self._swap(v1, v2)
+        pairs = np.array(pairs)
+        loc_ids1, loc_ids2 = order[pairs[:, 0]], order[pairs[:, 1]]
+        past_locations = np.concatenate([loc_ids1, loc_ids2])
+        new_locations = np.concatenate([loc_ids2, loc_ids1])
+        self._pending_swap = (new_locations, env.get_vertex_types(past_locations))
+        return DynamicsOutput(
+            past_locations=past_locations,
+            new_locations=new_locations,
+            is_end=False
+        )
+
+    def _reset_schedule(self, env: BaseGraphEnvironment):
+        '''
+            Order all the vertices by (utility, location id).
+        '''
+        self._env_state = (env.get_neighborhood_type_matrix(), env.utility)
+        self._utilities = env.compute_utilities()
+        self._order = np.argsort(self._utilities, kind='stable')
+        # number of swaps when each vertex last changed, 
+        # and when its pairs with all the later vertices were last found invalid
+        self._num_swaps = 0
+        self._affected_at = np.zeros(env.num_vertices, dtype=np.int64)
+        self._checked_at = np.full(env.num_vertices, -1, dtype=np.int64)
+        self._pending_swap = None
+        self._utility_bounds = self._get_utility_bounds(env)
+
+    def _update_schedule(self, env: BaseGraphEnvironment):
+        '''
+            Re-evaluate and re-insert the vertices affected by the last swap.
+
+            Return:
+                False if the environment changed in another way 
+                and the schedule has to be reset.
+        '''
+        if self._env_state is None or \
+            self._env_state[0] is not env.get_neighborhood_type_matrix() or \
+            self._env_state[1] is not env.utility:
+            return False
+        if self._pending_swap is None:
+            return True
+        loc_ids, new_types = self._pending_swap
+        if np.any(env.get_vertex_types(loc_ids) != new_types):
+            return False
+
+        affected = env.get_affected_ids(loc_ids)
+        self._num_swaps += 1
+        self._affected_at[self._get_dependent_ids(env, loc_ids)] = self._num_swaps
+        self._utilities[affected] = env.compute_utilities(loc_ids=affected)
+        is_affected = np.zeros(env.num_vertices, dtype=bool)
+        is_affected[affected] = True
+        order = self._order[~is_affected[self._order]]
+        order_utilities = self._utilities[order]
+        affected = affected[np.argsort(self._utilities[affected], kind='stable')]
+        insert_at = []
+        for loc_id, utility in zip(affected.tolist(), self._utilities[affected].tolist()):
+            start = np.searchsorted(order_utilities, utility, side='left')
+            end = np.searchsorted(order_utilities, utility, side='right')
+            insert_at.append(start + np.searchsorted(order[start:end], loc_id))
+        self._order = np.insert(order, insert_at, affected)
+        return True
+
+    def _get_utility_bounds(self, env: BaseGraphEnvironment, max_compositions: int = 2**16):
+        '''
+            Under INDIVIDUAL_GREATER, get the max utility of each type over all the 
+            neighbourhood compositions, if all the neighbourhoods have the same size.
+
+            Return:
+                np.array of shape (num_types,), or None
+        '''
+        if self.swap_condition != INDIVIDUAL_GREATER:
+            return None
+        # the compositions of a weighted neighbourhood are not integer
+        weights = env._get_neighbourhood_weights()
+        if weights is not None and np.any(weights != np.floor(weights)):
+            return None
+        graph_degrees = np.sum(env.get_neighborhood_type_matrix(), axis=1)
+        graph_degree = graph_degrees[0]
+        if np.any(graph_degrees != graph_degree) or graph_degree != int(graph_degree) or \
+            comb(int(graph_degree) + env.num_types, env.num_types) > max_compositions:
+            return None
+        compositions = get_compositions(env.num_types, int(graph_degree))
+        compositions = compositions[np.sum(compositions, axis=1) == graph_degree].astype(float)
+        bounds = np.zeros(env.num_types)
+        for t in range(env.num_types):
+            utilities = env.utility.compute_batch(np.full(len(compositions), t), compositions)
+            bounds[t] = np.max(np.where(np.isnan(utilities), -np.inf, utilities))
+        return bounds
+
+
+class SublatticeSwapper(BaseSwapper):
+    '''
+        Swap many pairs at once on a fully wrapped GridWorld.
+
+        Each step randomly pairs up all the cells and evaluates all the pairs at once. 
+        Among the pairs satisfying the swap condition, it keeps a set of pairs whose 
+        cells are further apart than the reach of the swap condition, so that 
+        swapping one of them never changes how the others are evaluated:
+        each pair gets a random priority, and is kept if no cell of a pair of higher 
+        priority is within the reach of its cells (a sublattice of the grid, 
+        chosen anew at each step). The kept pairs are swapped in one batched DynamicsOutput.
+        If no pair of the matching can swap, the world is checked for stability 
+        (see `dynamics.stability`): the run ends if it is stable, 
+        and the improving pair found is swapped otherwise.
+    '''
+    def __init__(self, swap_condition:int=0, seed:int=None):
+        '''
+            Args:
+                swap_condition: the swap condition
+                seed: (optional) seed of the Generator used to pair up the cells
+        '''
+        super().__init__(swap_condition)
+        self._rng = np.random.default_rng(seed)
+        self._env = None
+        self._scan_start = 0
+
+    def _get_reach(self, env: BaseGraphEnvironment):
+        '''
+            Get the max distance (along any axis) at which a change of type 
+            can change the evaluation of a swap.
+        '''
+        stencil = getattr(env, '_neighbour_stencil', None)
+        if stencil is None:
+            raise ValueError('SublatticeSwapper needs a GridWorld with all the indices wrapped.')
+        offset = int(np.max(np.abs(stencil)))
+        reach = offset * env.neigh_radius
+        if getattr(env, 'neighbour_kernel', None) is not None:
+            reach = int(np.max(env.neighbour_kernel.shape)) // 2
+        if self.swap_condition == COLLECTIVE_GREATER:
+            reach += offset
+        return reach
+
+    def _get_non_interacting(self, env: BaseGraphEnvironment, loc_ids1: np.ndarray, loc_ids2: np.ndarray):
+        '''
+            Randomly select pairs whose cells are not within the reach of the cells of the other selected pairs.
+
+            Return:
+                np.array of bool, one for each pair
+        '''
+        priorities = self._rng.permutation(len(loc_ids1))
+        cell_priorities = np.full(env.num_vertices, -1, dtype=np.int64)
+        cell_priorities[loc_ids1] = priorities
+        cell_priorities[loc_ids2] = priorities
+        # highest priority of a cell within the reach of each cell
+        max_priorities = scipy.ndimage.maximum_filter(
+            cell_priorities.reshape(env.world_size), size=2*self._reach+1, mode='wrap').reshape(-1)
+        return (max_priorities[loc_ids1] == priorities) & (max_priorities[loc_ids2] == priorities)
+
+    def step(self, env: BaseGraphEnvironment):
+        if self._env is not env:
+            self._env = env
+            self._reach = self._get_reach(env)
+            self._scan_start = 0
+        loc_ids = self._rng.permutation(env.num_vertices)
+        num_pairs = env.num_vertices // 2
+        loc_ids1, loc_ids2 = loc_ids[:num_pairs], loc_ids[num_pairs:2*num_pairs]
+        is_accepted = np.zeros(num_pairs, dtype=bool)
+        for start in range(0, num_pairs, _CHUNK_SIZE):
+            is_accepted[start:start+_CHUNK_SIZE] = self._accepted_swaps(
+                env, loc_ids1[start:start+_CHUNK_SIZE], loc_ids2[start:start+_CHUNK_SIZE])
+        loc_ids1, loc_ids2 = loc_ids1[is_accepted], loc_ids2[is_accepted]
+        if len(loc_ids1) == 0:
+            pair = self._find_improving_swap(env, self._scan_start)
+            if pair is None:
+                return self.end_response()
+            # the vertices scanned before the pair found cannot swap
+            self._scan_start = pair[0]
+            loc_ids1, loc_ids2 = np.array(pair[:1]), np.array(pair[1:])
+        else:
+            is_kept = self._get_non_interacting(env, loc_ids1, loc_ids2)
+            loc_ids1, loc_ids2 = loc_ids1[is_kept], loc_ids2[is_kept]
+        return DynamicsOutput(
+            past_locations=np.concatenate([loc_ids1, loc_ids2]),
+            new_locations=np.concatenate([loc_ids2, loc_ids1]),
+            is_end=False
+        )
+
+
+class SteepestDescentSwapper(BaseSwapper):
+    '''
+        Swap the pair with the largest gain over all the pairs of different types 
+        satisfying the swap condition: the largest sum of the utility gains for SUM_GREATER, 
+        and the largest min of the two utility gains for the individual conditions
+        (ties are broken by the smallest location ids).
+
+        The gains are read from the placement utility matrix by blocks of chunk_size x chunk_size 
+        pairs for each pair of types, and computed exactly for the neighbouring pairs.
+    '''
+    def __init__(self, swap_condition:int=0, chunk_size:int=1024):
+        '''
+            Args:
+                swap_condition: the swap condition (COLLECTIVE_GREATER is not supported)
+                chunk_size: (optional) max number of vertices of each type in a block of pairs
+        '''
+        if swap_condition == COLLECTIVE_GREATER:
+            raise ValueError('SteepestDescentSwapper does not support COLLECTIVE_GREATER.')
+        super().__init__(swap_condition)
+        self.chunk_size = chunk_size
+
+    def _get_gains(self, u1: np.ndarray, u2: np.ndarray, u12: np.ndarray, u21: np.ndarray):
+        '''
+            Gain of each swap, -inf if it does not satisfy the swap condition.
+        '''
+        if self.swap_condition == SUM_GREATER:
+            gains = (u12 + u21) - (u1 + u2)
+        else:
+            gains = np.minimum(u12 - u1, u21 - u2)
+        return np.where(self._is_improving(u1, u2, u12, u21), gains, -np.inf)
+
+    def _get_best(self, best: tuple, gains: np.ndarray, loc_ids1: np.ndarray, loc_ids2: np.ndarray):
+        '''
+            Update best = (gain, loc_id1, loc_id2) with the pairs (loc_ids1, loc_ids2) of largest gain.
+        '''
+        max_gain = np.max(gains)
+        if max_gain == -np.inf or max_gain < best[0]:
+            return best
+        is_max = gains == max_gain
+        lower = np.minimum(loc_ids1, loc_ids2)[is_max]
+        upper = np.maximum(loc_ids1, loc_ids2)[is_max]
+        k = np.lexsort((upper, lower))[0]
+        if max_gain > best[0] or (int(lower[k]), int(upper[k])) < best[1:]:
+            return (max_gain, int(lower[k]), int(upper[k]))
+        return best
+
+    def step(self, env: BaseGraphEnvironment):
+        placement_utility_matrix = env.get_placement_utility_matrix()
+        types = env.get_vertex_types(np.arange(env.num_vertices))
+        utilities = self._get_utilities(env, np.arange(env.num_vertices))
+        best = (-np.inf, -1, -1)
+
+        # neighbouring pairs, whose utilities after the swap are not in the placement utility matrix
+        neigh_ids1, neigh_ids2 = env.get_neighbourhood_pairs()
+        is_pair = (neigh_ids1 < neigh_ids2) & (types[neigh_ids1] != types[neigh_ids2])
+        if np.any(is_pair):
+            loc_ids1, loc_ids2 = neigh_ids1[is_pair], neigh_ids2[is_pair]
+            u12, u21 = env.compute_swap_utilities(loc_ids1, loc_ids2)
+            gains = self._get_gains(utilities[loc_ids1], utilities[loc_ids2], u12, u21)
+            best = self._get_best(best, gains, loc_ids1, loc_ids2)
+        neigh_counts = np.bincount(neigh_ids1, minlength=env.num_vertices)
+        neigh_indptr = np.concatenate([[0], np.cumsum(neigh_counts)])
+
+        # all the other pairs, by blocks
+        columns = np.full(env.num_vertices, -1, dtype=np.int64)
+        loc_ids_by_type = [np.flatnonzero(types == t) for t in range(env.num_types)]
+        for t1 in range(env.num_types):
+            for t2 in range(t1+1, env.num_types):
+                for start1 in range(0, len(loc_ids_by_type[t1]), self.chunk_size):
+                    loc_ids1 = loc_ids_by_type[t1][start1:start1+self.chunk_size]
+                    for start2 in range(0, len(loc_ids_by_type[t2]), self.chunk_size):
+                        loc_ids2 = loc_ids_by_type[t2][start2:start2+self.chunk_size]
+                        gains = self._get_gains(utilities[loc_ids1][:, None], 
+                                                utilities[loc_ids2][None, :],
+                                                placement_utility_matrix[loc_ids2, t1][None, :], 
+                                                placement_utility_matrix[loc_ids1, t2][:, None])
+                        columns[loc_ids2] = np.arange(len(loc_ids2))
+                        owner, neigh_ids = _gather_csr_rows(neigh_indptr, neigh_ids2, loc_ids1)
+                        is_neighbour = columns[neigh_ids] >= 0
+                        gains[owner[is_neighbour], columns[neigh_ids[is_neighbour]]] = -np.inf
+                        columns[loc_ids2] = -1
+                        best = self._get_best(best, gains, 
+                                              np.broadcast_to(loc_ids1[:, None], gains.shape), 
+                                              np.broadcast_to(loc_ids2[None, :], gains.shape))
+        if best[0] == -np.inf:
+            return self.end_response()
+        return self._swap(Vertex(loc_idx=best[1], type=int(types[best[1]])), 
+                          Vertex(loc_idx=best[2], type=int(types[best[2]])))
@@ -1,31 +1,130 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
 from dataclasses import dataclass 
+import hashlib
+import json
+import os.path
 import numpy as np
+import scipy.sparse
 
 from graph_envs.grid_initializations import random_init
+from utilities.base_utility import EMPTY
 
 from typing import TYPE_CHECKING, Callable, Any
 if TYPE_CHECKING:
     from dynamics.base_dynamic import BaseDynamics, DynamicsOutput
     from utilities.base_utility import BaseUtility
 
-@dataclass
+def _gather_csr_rows(indptr: np.ndarray, indices: np.ndarray, row_ids: np.ndarray):
+    '''
+        Gather several rows of a CSR structure at once.
+
+        Return:
+            (owner, values): the position in row_ids each gathered value comes from,
+                             and the gathered values
+    '''
+    starts = indptr[row_ids]
+    lengths = indptr[row_ids+1] - starts
+    owner = np.repeat(np.arange(len(row_ids)), lengths)
+    offsets = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owner, indices[np.repeat(starts, lengths) + offsets]
+
+
+# number of vertices processed at once by the passes over the whole world
+_CHUNK_SIZE = 2**20
+
+
+def _splitmix64(x: np.ndarray):
+    '''
+        SplitMix64 finalizer: a bijective mixing of 64-bit integers (np.uint64, wrapping arithmetic).
+    '''
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+# open neighbourhoods of radius > 1, shared by the environments over the same graph
+_NEIGHBOURHOODS = OrderedDict()
+_MAX_NEIGHBOURHOODS = 8
+
+
+def _get_ball_neighbourhood(indptr: np.ndarray, indices: np.ndarray, radius: int):
+    '''
+        Get the open neighbourhood of the given radius of every vertex from the immediate 
+        neighbours (CSR form), as the boolean sparse matrix power (A + A^2 + ... + A^radius) 
+        without its diagonal (a vertex is only its own neighbour through a loop in A). 
+        It is cached per graph and radius.
+
+        Return:
+            (indptr, indices), with the neighbours of each vertex sorted
+    '''
+    num_vertices = len(indptr) - 1
+    key = (radius, hashlib.sha1(np.ascontiguousarray(indptr)).hexdigest(), 
+           hashlib.sha1(np.ascontiguousarray(indices)).hexdigest())
+    if key in _NEIGHBOURHOODS:
+        _NEIGHBOURHOODS.move_to_end(key)
+        return _NEIGHBOURHOODS[key]
+    adjacency = scipy.sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), 
+                                        shape=(num_vertices, num_vertices))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+    ball = adjacency
+    for _ in range(1, radius):
+        ball = ball + ball @ adjacency
+        ball.data[:] = 1
+    ball = ball.tocoo()
+    is_loop = adjacency.diagonal() > 0
+    keep = (ball.row != ball.col) | is_loop[ball.row]
+    ball = scipy.sparse.csr_matrix((ball.data[keep], (ball.row[keep], ball.col[keep])), 
+                                   shape=(num_vertices, num_vertices))
+    ball.sort_indices()
+    _NEIGHBOURHOODS[key] = (ball.indptr.astype(np.int64), ball.indices.astype(np.int64))
+    if len(_NEIGHBOURHOODS) > _MAX_NEIGHBOURHOODS:
+        _NEIGHBOURHOODS.popitem(last=False)
+    return _NEIGHBOURHOODS[key]
+
+
+@dataclass(slots=True)
 class Vertex:
     '''
         A vertex in the graph environment.
         Args:
-            loc_idx: location indices of the vertex in the graph
+            loc_idx: flat location id of the vertex in the graph
             type: the type of the vertex
             neigh_type_vector: neighbourhood-type vector (the number 
                                of vertex for each type in the vertex's open neighbourhood, 
-                               i.e.: excluding itself)
+                               i.e.: excluding itself, or their total weight 
+                               in a weighted neighbourhood)
     '''
     loc_idx: Any = None
     type: Any = None
     neigh_type_vector: np.array = None
 
 
+@dataclass
+class VertexBlock:
+    '''
+        A batch of vertices in the graph environment, stored as contiguous arrays.
+        Args:
+            loc_idx: np.array of flat location ids of the vertices
+            type: np.array of the types of the vertices
+            neigh_type_vector: np.array of shape (len(loc_idx), num_types), 
+                               the neighbourhood-type vector of each vertex
+    '''
+    loc_idx: np.ndarray = None
+    type: np.ndarray = None
+    neigh_type_vector: np.ndarray = None
+
+    def __len__(self):
+        return len(self.loc_idx)
+
+    def __getitem__(self, i: int):
+        return Vertex(loc_idx=self.loc_idx[i], type=self.type[i], 
+                      neigh_type_vector=self.neigh_type_vector[i])
+
+
 class BaseGraphEnvironment(ABC):
     '''
         This is the base class for an arbitrary graph environment. 
@@ -35,6 +134,11 @@ class BaseGraphEnvironment(ABC):
         A vertex's neighbourhood consist of all its immediate neighbours (if neigh_radius=1), 
         and the immediate meighbours of their immediate neighbours (if neigh_radius=2),
         etc (similar pattern for neigh_radius>=3)
+        Locations of type EMPTY are vacancies: they are not counted in the neighbourhood-type vectors.
+
+        Subclasses must build the immediate neighbour index in CSR form 
+        (`self.neighbour_indptr` and `self.neighbour_indices`, over flat vertex ids) 
+        before calling `BaseGraphEnvironment.__init__`.
     '''
 
     def __init__(self, 
@@ -47,7 +151,9 @@ class BaseGraphEnvironment(ABC):
                  neigh_radius: int = 1,
                  init_func: Callable = random_init,
                  init_rand_seed:int = -1,
-                 verbosity: int = 0):
+                 verbosity: int = 0,
+                 history_size: int = 0,
+                 memmap_dir: str = None):
         '''
             Args:
                 num_vertices: number of vertices in the world
@@ -60,6 +166,11 @@ class BaseGraphEnvironment(ABC):
                 init_func: world initializaton function.
                 init_rand_seed: random seed for the world initialization.
                 verbosity: for printing debug message (default 0)
+                history_size: number of past world hashes kept to detect cycles 
+                              (default 0: no cycle detection, the run only ends with the dynamics)
+                memmap_dir: (optional) directory of the files backing the world and the 
+                            neighbourhood-type matrix (`np.memmap`), for worlds larger than RAM. 
+                            It must not be shared by two environments.
         '''
         self.num_vertices = num_vertices
         self.num_edges = num_edges
@@ -72,8 +183,114 @@ class BaseGraphEnvironment(ABC):
         self.neigh_radius = neigh_radius
         self.verbosity = verbosity
         self.done = False
+        self._neighbourhood = None
+        self._neighbourhood_weights = None
+        self._reverse_neighbourhood = None
+        self._reverse_neighbourhood_weights = None
+        self._neigh_type_matrix = None
+        self._placement_utility_matrix = None
+        self.history_size = history_size
+        self.memmap_dir = memmap_dir
+        if memmap_dir is not None:
+            os.makedirs(memmap_dir, exist_ok=True)
 
         init_func(self, init_rand_seed)
+        self._reset_history()
+
+    @property
+    def world(self):
+        '''
+            The type assignment of the world, stored with the narrowest integer dtype 
+            holding EMPTY and the types (see `_get_type_dtype`).
+            Assigning a new world resets the cached neighbourhood-type matrix, 
+            the world hash and the history of the past world hashes, 
+            but changing it in place does not: use `move_vertices` instead.
+        '''
+        return self._world
+
+    @world.setter
+    def world(self, world: np.ndarray):
+        world = np.asarray(world)
+        if self.memmap_dir is None:
+            self._world = np.ascontiguousarray(world, dtype=self._get_type_dtype())
+        else:
+            target = self._get_memmap('world', world.shape, self._get_type_dtype())
+            target[...] = world
+            self._world = target
+        self._neigh_type_matrix = None
+        self._placement_utility_matrix = None
+        self.world_hash = 0
+        for start in range(0, self.num_vertices, _CHUNK_SIZE):
+            loc_ids = np.arange(start, min(start + _CHUNK_SIZE, self.num_vertices))
+            self.world_hash ^= int(np.bitwise_xor.reduce(self._get_zobrist_keys(loc_ids, self._flat_world[loc_ids])))
+        self._reset_history()
+
+    @property
+    def _flat_world(self):
+        '''
+            Flat view of the world, indexed by flat vertex id. It is not stored, 
+            so that copies of the environment (`copy.deepcopy`, pickling) keep a single world.
+        '''
+        return self._world.reshape(-1)
+
+    def _get_type_dtype(self):
+        '''
+            Get the narrowest integer dtype holding EMPTY and all the types (int8 up to 128 types).
+        '''
+        # the narrowest signed dtype holding -num_types also holds num_types - 1
+        return np.min_scalar_type(-self.num_types)
+
+    def _get_memmap(self, name: str, shape: tuple, dtype: np.dtype):
+        '''
+            Open the array `name` in `memmap_dir` (a `.npy` file), 
+            created again if it does not have the given shape and dtype.
+        '''
+        path = os.path.join(self.memmap_dir, name + '.npy')
+        if os.path.exists(path):
+            array = np.load(path, mmap_mode='r+')
+            if array.shape == tuple(shape) and array.dtype == dtype:
+                return array
+            del array
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+    def _get_zobrist_keys(self, loc_ids: np.ndarray, types: np.ndarray):
+        '''
+            Get the pseudo-random 64-bit keys of (location, type), EMPTY having its own keys.
+            The hash of a world is the xor of the keys of its vertices (Zobrist hashing), 
+            so it is updated in O(1) per moved vertex. The keys are computed by mixing 
+            loc_id * (num_types + 1) + type + 1 rather than stored in a table.
+        '''
+        keys = (np.asarray(loc_ids, dtype=np.uint64) * np.uint64(self.num_types + 1) 
+                + (np.asarray(types, dtype=np.int64) + 1).astype(np.uint64))
+        return _splitmix64(keys)
+
+    def _reset_history(self):
+        '''
+            Start the history of the world hashes from the current world.
+        '''
+        self.num_moves = 0
+        self.cycle_period = None
+        self._history = {self.world_hash: 0}
+        self._history_order = deque([self.world_hash])
+
+    def _record_world(self):
+        '''
+            Add the current world to the history, or end the simulation 
+            if it is already in it: `cycle_period` is then the number of moves since it was seen.
+        '''
+        self.num_moves += 1
+        if self.history_size <= 0:
+            return
+        if self.world_hash in self._history:
+            self.cycle_period = self.num_moves - self._history[self.world_hash]
+            self.done = True
+            if self.verbosity > 0:
+                print('Cycle of period %d detected after %d moves' % (self.cycle_period, self.num_moves))
+            return
+        self._history[self.world_hash] = self.num_moves
+        self._history_order.append(self.world_hash)
+        if len(self._history_order) > self.history_size:
+            del self._history[self._history_order.popleft()]
 
     @abstractmethod
     def get_vertex(self, loc_idx: Any):
@@ -112,10 +329,24 @@ class BaseGraphEnvironment(ABC):
         '''
         return None
 
+    def get_vertex_types(self, loc_ids: np.ndarray):
+        '''
+            Get the types of the vertices at flat ids loc_ids.
+
+            Args:
+                loc_ids: np.array of flat location indices
+
+            Return:
+                np.array of types
+        '''
+        return np.array([self.get_vertex_type(int(loc_id)) for loc_id in loc_ids], dtype=int)
+
     @abstractmethod
     def set_vertex_type(self, given_type: Any, loc_idx: Any):
         '''
             Set a type to a vertex at loc_idx.
+            This does not update the neighbourhood-type matrix, 
+            vertices are moved with `move_vertices`.
 
             Args:
                 given_type: given type to set
@@ -123,6 +354,18 @@ class BaseGraphEnvironment(ABC):
         '''
         pass
 
+    def set_vertex_types(self, given_types: np.ndarray, loc_ids: np.ndarray):
+        '''
+            Set the types of the vertices at flat ids loc_ids.
+            Like `set_vertex_type`, this does not update the neighbourhood-type matrix.
+
+            Args:
+                given_types: np.array of types to set
+                loc_ids: np.array of distinct flat location indices
+        '''
+        for given_type, loc_id in zip(given_types.tolist(), loc_ids.tolist()):
+            self.set_vertex_type(given_type, loc_id)
+
     @abstractmethod
     def get_max_degree(self):
         '''
@@ -147,6 +390,42 @@ class BaseGraphEnvironment(ABC):
             return v
     ### end
     
+    def _flat_index(self, loc_idx: Any):
+        '''
+            Convert a location index to the flat vertex id used by the neighbour index.
+        '''
+        return int(loc_idx)
+
+    def _flat_indices(self, locations: Any):
+        '''
+            Convert a list of location indices to an np.array of flat vertex ids.
+        '''
+        locations = np.asarray(locations)
+        if locations.ndim == 1 and np.issubdtype(locations.dtype, np.integer):
+            return locations.astype(np.int64, copy=False)
+        return np.array([self._flat_index(loc_idx) for loc_idx in locations], dtype=np.int64)
+
+    def get_location(self, loc_ids: Any):
+        '''
+            Convert flat location ids to the location indices of the graph, 
+            for visualization and output.
+        '''
+        return loc_ids
+
+    def get_neighbour_ids(self, loc_idx: Any):
+        '''
+            Get the flat ids of the immediate neighbours of the vertex at loc_idx
+            from the precomputed neighbour index.
+
+            Args:
+                loc_idx: location index of the reference vertex
+
+            Return:
+                np.array of flat vertex ids
+        '''
+        v_id = self._flat_index(loc_idx)
+        return self.neighbour_indices[self.neighbour_indptr[v_id]:self.neighbour_indptr[v_id+1]]
+
     @abstractmethod
     def get_immediate_neighbours(self, vertex: Vertex, as_dict=False):
         '''
@@ -161,6 +440,90 @@ class BaseGraphEnvironment(ABC):
         '''
         return None
 
+    def _get_neighbourhood(self):
+        '''
+            Get the open neighbourhood of radius `neigh_radius` of every vertex, 
+            in CSR form over flat vertex ids. It is built once from the neighbour index
+            (see `_get_ball_neighbourhood`).
+
+            Return:
+                (indptr, indices)
+        '''
+        if self._neighbourhood is not None:
+            return self._neighbourhood
+        if self.neigh_radius <= 1:
+            self._neighbourhood = (self.neighbour_indptr, self.neighbour_indices)
+        else:
+            self._neighbourhood = _get_ball_neighbourhood(self.neighbour_indptr, self.neighbour_indices, 
+                                                          self.neigh_radius)
+        return self._neighbourhood
+
+    def _get_neighbourhood_weights(self):
+        '''
+            Get the weight of each neighbour in the neighbourhood-type vectors, 
+            aligned with the indices of `_get_neighbourhood`. 
+            Subclasses with weighted neighbourhoods set `self._neighbourhood_weights` 
+            when they build the neighbourhood.
+
+            Return:
+                np.array of weights, or None if every neighbour counts once
+        '''
+        self._get_neighbourhood()
+        return self._neighbourhood_weights
+
+    def _get_reverse_neighbourhood(self):
+        '''
+            Get, for every vertex, the vertices having it in their open neighbourhood,
+            in CSR form over flat vertex ids. These are the rows of the neighbourhood-type
+            matrix to update when the vertex changes type.
+
+            Return:
+                (indptr, indices)
+        '''
+        if self._reverse_neighbourhood is not None:
+            return self._reverse_neighbourhood
+        indptr, indices = self._get_neighbourhood()
+        weights = self._get_neighbourhood_weights()
+        # the transpose of the neighbourhood matrix, by a counting sort of the entries by column 
+        # (the rows of each column stay in increasing order)
+        neighbourhood = scipy.sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int8) if weights is None else weights, indices, indptr), 
+            shape=(self.num_vertices, self.num_vertices))
+        reverse = neighbourhood.tocsc()
+        self._reverse_neighbourhood = (reverse.indptr.astype(np.int64), reverse.indices.astype(np.int64))
+        if weights is not None:
+            self._reverse_neighbourhood_weights = reverse.data
+        return self._reverse_neighbourhood
+
+    def get_neighbourhood_pairs(self):
+        '''
+            Get all the pairs of vertices such that one is in the open neighbourhood of the other.
+
+            Return:
+                (loc_ids1, loc_ids2): np.arrays of flat location ids, with each pair in both orders
+        '''
+        indptr, indices = self._get_neighbourhood()
+        rows = np.repeat(np.arange(self.num_vertices), np.diff(indptr))
+        keys = np.unique(np.concatenate([rows * self.num_vertices + indices, 
+                                         indices * self.num_vertices + rows]))
+        return keys // self.num_vertices, keys % self.num_vertices
+
+    def get_affected_ids(self, loc_ids: np.ndarray):
+        '''
+            Get the vertices whose type or neighbourhood-type vector
+            changes when the types at the given locations change.
+
+            Args:
+                loc_ids: np.array of flat location ids
+
+            Return:
+                sorted np.array of flat location ids
+        '''
+        loc_ids = self._flat_indices(loc_ids)
+        reverse_indptr, reverse_indices = self._get_reverse_neighbourhood()
+        _, rows = _gather_csr_rows(reverse_indptr, reverse_indices, loc_ids)
+        return np.unique(np.concatenate([loc_ids, rows]))
+
     def get_neighborhood_type_vector(self, vertex: Vertex):
         '''
             Calculate the array of types in the open neighborhood 
@@ -174,25 +537,118 @@ class BaseGraphEnvironment(ABC):
             Return:
                 np.array of the count for each type
         '''
+        v_id = self._flat_index(vertex.loc_idx)
+        indptr, indices = self._get_neighbourhood()
+        neigh_types = self.get_vertex_types(indices[indptr[v_id]:indptr[v_id+1]])
+        weights = self._get_neighbourhood_weights()
+        weights = 1 if weights is None else weights[indptr[v_id]:indptr[v_id+1]][neigh_types != EMPTY]
         neigh_type_vector = np.zeros(self.num_types)
-        neigh_vertices = self.get_immediate_neighbours(vertex, as_dict=True)
-        for n_v in neigh_vertices.values():
-            neigh_type_vector[n_v.type] += 1
-        ref_v_loc = tuple(vertex.loc_idx)
-        
-        neigh_loc = list(neigh_vertices.keys())
-        for _ in range(1, self.neigh_radius):
-            additional_neigh_loc = {}
-            for i in neigh_loc:
-                additional_neigh_vertices = self.get_immediate_neighbours(neigh_vertices[i], as_dict=True)
-                for nn_v in additional_neigh_vertices.keys():
-                    if nn_v not in neigh_vertices and nn_v != ref_v_loc:
-                        neigh_vertices[nn_v] = additional_neigh_vertices[nn_v]
-                        neigh_type_vector[neigh_vertices[nn_v].type] += 1
-                        additional_neigh_loc[nn_v] = None
-            neigh_loc = additional_neigh_loc.keys()
+        np.add.at(neigh_type_vector, neigh_types[neigh_types != EMPTY], weights)
         return neigh_type_vector
-    
+
+    def _get_count_dtype(self):
+        '''
+            Get the dtype of the neighbourhood-type matrix: the narrowest unsigned integer 
+            dtype holding the size of the largest neighbourhood (uint8 up to 255 neighbours), 
+            or float for a weighted neighbourhood.
+        '''
+        if self._get_neighbourhood_weights() is not None:
+            return np.dtype(float)
+        indptr, _ = self._get_neighbourhood()
+        return np.min_scalar_type(int(np.max(np.diff(indptr), initial=0)))
+
+    def _compute_neighborhood_type_matrix(self, out: np.ndarray = None):
+        '''
+            Calculate the neighbourhood-type matrix from scratch, as the product of the 
+            (weighted) neighbourhood sparse matrix and the one-hot matrix of the types, 
+            by blocks of rows.
+
+            Args:
+                out: (optional) np.array of shape (num_vertices, num_types) to fill
+
+            Return:
+                out, or a new np.array of dtype `_get_count_dtype()`
+        '''
+        if out is None:
+            out = np.empty((self.num_vertices, self.num_types), dtype=self._get_count_dtype())
+        indptr, indices = self._get_neighbourhood()
+        weights = self._get_neighbourhood_weights()
+        types = self.get_vertex_types(np.arange(self.num_vertices))
+        occupied_ids = np.flatnonzero(types != EMPTY)
+        one_hot = scipy.sparse.csr_matrix((np.ones(len(occupied_ids)), (occupied_ids, types[occupied_ids])), 
+                                          shape=(self.num_vertices, self.num_types))
+        neighbourhood = scipy.sparse.csr_matrix((np.ones(len(indices)) if weights is None else weights, indices, indptr), 
+                                                shape=(self.num_vertices, self.num_vertices))
+        for start in range(0, self.num_vertices, _CHUNK_SIZE):
+            out[start:start+_CHUNK_SIZE] = (neighbourhood[start:start+_CHUNK_SIZE] @ one_hot).toarray()
+        return out
+
+    def get_neighborhood_type_matrix(self):
+        '''
+            Get the neighbourhood-type vectors of all vertices, 
+            as exact counts in the dtype of `_get_count_dtype` 
+            (in `memmap_dir` if it is set).
+            The matrix is computed once and then kept up to date by `move_vertices`, 
+            so it must not be modified by the caller.
+
+            Return:
+                np.array of shape (num_vertices, num_types), where row i is 
+                the neighbourhood-type vector of the vertex with flat id i
+        '''
+        if self._neigh_type_matrix is None:
+            out = None
+            if self.memmap_dir is not None:
+                out = self._get_memmap('neigh_type_matrix', (self.num_vertices, self.num_types), 
+                                       self._get_count_dtype())
+            self._neigh_type_matrix = self._compute_neighborhood_type_matrix(out)
+        return self._neigh_type_matrix
+
+    def get_vertex_block(self, loc_ids: np.ndarray = None):
+        '''
+            Get a batch of vertices, with their neighbourhood-type vectors.
+
+            Args:
+                loc_ids: (optional) np.array of flat location ids
+                         if None, get all the vertices in flat id order
+
+            Return:
+                VertexBlock
+        '''
+        neigh_type_matrix = self.get_neighborhood_type_matrix()
+        if loc_ids is None:
+            loc_ids = np.arange(self.num_vertices)
+            return VertexBlock(loc_idx=loc_ids, 
+                               type=self.get_vertex_types(loc_ids), 
+                               neigh_type_vector=neigh_type_matrix)
+        loc_ids = self._flat_indices(loc_ids)
+        return VertexBlock(loc_idx=loc_ids, 
+                           type=self.get_vertex_types(loc_ids), 
+                           neigh_type_vector=neigh_type_matrix[loc_ids])
+
+    def compute_utilities(self, utility: BaseUtility = None, loc_ids: np.ndarray = None):
+        '''
+            Compute the utility mesure of many vertices at once, 
+            using the neighbourhood-type matrix of the whole world.
+
+            Args:
+                utility: (optional) the utility metric to use
+                         if None, use `self.utility`
+                loc_ids: (optional) np.array of flat location ids
+                         if None, compute for all the vertices
+
+            Return:
+                np.array of utilities, in the order of loc_ids (or flat vertex id)
+        '''
+        if utility is None:
+            utility = self.utility
+        loc_ids = np.arange(self.num_vertices) if loc_ids is None else self._flat_indices(loc_ids)
+        # by blocks of vertices, for the temporary arrays of the utility
+        utilities = np.empty(len(loc_ids))
+        for start in range(0, len(loc_ids), _CHUNK_SIZE):
+            utilities[start:start+_CHUNK_SIZE] = utility.compute_block(
+                self.get_vertex_block(loc_ids[start:start+_CHUNK_SIZE]))
+        return utilities
+
     def compute_utility(self, vertex: Vertex, utility: BaseUtility = None):
         '''
             Compute the utility mesure of a vertex. 
@@ -207,30 +663,190 @@ class BaseGraphEnvironment(ABC):
             Return:
                 the scalar utility measure
         '''
+        if vertex.type == EMPTY:
+            return np.nan
         if vertex.neigh_type_vector is None:
-            vertex.neigh_type_vector = self.get_neighborhood_type_vector(vertex)
+            v_id = self._flat_index(vertex.loc_idx)
+            # in float, as the counts may be stored in a narrow unsigned dtype
+            vertex.neigh_type_vector = self.get_neighborhood_type_matrix()[v_id].astype(float)
         if utility is None:
             return self.utility.compute(vertex)
         return utility.compute(vertex)
-    
+
+    def _compute_placement_utilities(self, utility: BaseUtility, loc_ids: np.ndarray):
+        '''
+            Compute the utility of each type at loc_ids, by blocks of vertices 
+            so that the batch of num_types neighbourhood-type vectors per vertex stays small.
+        '''
+        chunk_size = max(1, _CHUNK_SIZE // self.num_types)
+        placement_utilities = np.empty((len(loc_ids), self.num_types))
+        types = np.tile(np.arange(self.num_types), min(len(loc_ids), chunk_size))
+        for start in range(0, len(loc_ids), chunk_size):
+            chunk_ids = loc_ids[start:start+chunk_size]
+            neigh_type_matrix = np.repeat(self.get_neighborhood_type_matrix()[chunk_ids], self.num_types, axis=0)
+            placement_utilities[start:start+chunk_size] = utility.compute_batch(
+                types[:len(neigh_type_matrix)], neigh_type_matrix).reshape(len(chunk_ids), self.num_types)
+        return placement_utilities
+
+    def get_placement_utility_matrix(self, utility: BaseUtility = None):
+        '''
+            Get the utility a vertex of each type would have at each location,
+            given the current neighbourhood-type vectors.
+            It is computed for the last requested utility only, 
+            and then updated by `move_vertices` on the rows of the vertices 
+            neighbouring the changed locations.
+
+            Args:
+                utility: (optional) the utility metric to use
+                         if None, use `self.utility`
+
+            Return:
+                np.array of shape (num_vertices, num_types)
+        '''
+        if utility is None:
+            utility = self.utility
+        if self._placement_utility_matrix is None or self._placement_utility_matrix[0] is not utility:
+            self._placement_utility_matrix = (
+                utility, self._compute_placement_utilities(utility, np.arange(self.num_vertices)))
+        return self._placement_utility_matrix[1]
+
+    def get_swapped_vertex_block(self,
+                                 loc_ids1: np.ndarray,
+                                 loc_ids2: np.ndarray,
+                                 loc_ids: np.ndarray = None):
+        '''
+            Get a batch of vertices as they would be if the types at loc_ids1[k]
+            and loc_ids2[k] were swapped, without moving any vertex.
+            The neighbourhood-type vectors are derived from the current ones,
+            including when the swapped vertices are neighbours of each other.
+
+            Args:
+                loc_ids1: np.array of flat location ids
+                loc_ids2: np.array of flat location ids, swapped with loc_ids1
+                loc_ids: (optional) np.array of flat location ids of the vertices to get,
+                         one for each swapped pair. If None, use loc_ids2.
+
+            Return:
+                VertexBlock
+        '''
+        loc_ids1 = self._flat_indices(loc_ids1)
+        loc_ids2 = self._flat_indices(loc_ids2)
+        loc_ids = loc_ids2 if loc_ids is None else self._flat_indices(loc_ids)
+        types1 = self.get_vertex_types(loc_ids1)
+        types2 = self.get_vertex_types(loc_ids2)
+        types = np.where(loc_ids == loc_ids1, types2,
+                         np.where(loc_ids == loc_ids2, types1, self.get_vertex_types(loc_ids)))
+        neigh_type_matrix = self.get_neighborhood_type_matrix()[loc_ids]
+        # number of times (or total weight with which) each swapped vertex 
+        # is in the neighbourhood of the vertex
+        indptr, indices = self._get_neighbourhood()
+        owner, neigh_ids = _gather_csr_rows(indptr, indices, loc_ids)
+        weights = self._get_neighbourhood_weights()
+        if weights is not None:
+            _, weights = _gather_csr_rows(indptr, weights, loc_ids)
+        is_swapped1 = neigh_ids == loc_ids1[owner]
+        is_swapped2 = neigh_ids == loc_ids2[owner]
+        counts1 = np.bincount(owner[is_swapped1], None if weights is None else weights[is_swapped1], 
+                              minlength=len(loc_ids))
+        counts2 = np.bincount(owner[is_swapped2], None if weights is None else weights[is_swapped2], 
+                              minlength=len(loc_ids))
+        rows = np.arange(len(loc_ids))
+        # the new counts are computed in a signed dtype, and then fit the (unsigned) count dtype
+        # (a swap of two vertices of the same type changes nothing)
+        for swapped_types, delta in [(types1, counts2 - counts1), (types2, counts1 - counts2)]:
+            is_occupied = (swapped_types != EMPTY) & (types1 != types2)
+            index = (rows[is_occupied], swapped_types[is_occupied])
+            neigh_type_matrix[index] = neigh_type_matrix[index] + delta[is_occupied]
+        return VertexBlock(loc_idx=loc_ids, type=types, neigh_type_vector=neigh_type_matrix)
+
+    def compute_swap_utilities(self,
+                               loc_ids1: np.ndarray,
+                               loc_ids2: np.ndarray,
+                               utility: BaseUtility = None):
+        '''
+            Compute the utilities the vertices would have after swapping
+            the types at loc_ids1[k] and loc_ids2[k], without moving any vertex.
+            They are read from the placement utility matrix, except for the pairs 
+            where a swapped vertex is in the neighbourhood of the other (or its own).
+            The utilities of the EMPTY locations are NaN.
+
+            Args:
+                loc_ids1: np.array of flat location ids
+                loc_ids2: np.array of flat location ids, swapped with loc_ids1
+                utility: (optional) the utility metric to use
+                         if None, use `self.utility`
+
+            Return:
+                (u12, u21): np.arrays of the utilities of the vertices from loc_ids1 at loc_ids2,
+                            and of the vertices from loc_ids2 at loc_ids1
+        '''
+        if utility is None:
+            utility = self.utility
+        loc_ids1 = self._flat_indices(loc_ids1)
+        loc_ids2 = self._flat_indices(loc_ids2)
+        placement_utility_matrix = self.get_placement_utility_matrix(utility)
+        types1 = self.get_vertex_types(loc_ids1)
+        types2 = self.get_vertex_types(loc_ids2)
+        u12 = np.where(types1 != EMPTY, placement_utility_matrix[loc_ids2, types1], np.nan)
+        u21 = np.where(types2 != EMPTY, placement_utility_matrix[loc_ids1, types2], np.nan)
+
+        indptr, indices = self._get_neighbourhood()
+        is_adjacent = np.zeros(len(loc_ids1), dtype=bool)
+        for center_ids in [loc_ids1, loc_ids2]:
+            owner, neigh_ids = _gather_csr_rows(indptr, indices, center_ids)
+            is_adjacent[owner[(neigh_ids == loc_ids1[owner]) | (neigh_ids == loc_ids2[owner])]] = True
+        if np.any(is_adjacent):
+            adjacent = np.flatnonzero(is_adjacent)
+            loc_ids1, loc_ids2 = loc_ids1[adjacent], loc_ids2[adjacent]
+            utilities = utility.compute_block(self.get_swapped_vertex_block(
+                np.concatenate([loc_ids1, loc_ids1]), 
+                np.concatenate([loc_ids2, loc_ids2]), 
+                np.concatenate([loc_ids2, loc_ids1])))
+            u12[adjacent] = utilities[:len(adjacent)]
+            u21[adjacent] = utilities[len(adjacent):]
+        return u12, u21
+
     def move_vertices(self, dynamic_output: DynamicsOutput):
         '''
             Logic to move the vertices. 
             Set the type of the vertex at the new location 
-            to be the type of the vertex at the old locations.
+            to be the type of the vertex at the old locations
+            (the new locations must be distinct).
+            The neighbourhood-type matrix (if computed) is updated 
+            only on the rows of the vertices neighbouring the changed locations, 
+            and the world hash with the keys of the changed locations.
 
             Args:
                 dynamic_output: the output message of the world dynamic engine
         '''
-        type_list = [self.get_vertex_type(loc_idx) for loc_idx in dynamic_output.past_locations]
-        for new_loc, past_loc, to_type in zip(dynamic_output.new_locations, dynamic_output.past_locations, type_list):
-            # if self.verbosity == 1:
-            #     print('Moving vertex at', past_loc, 'to', new_loc, 'type=', to_type)
-            self.set_vertex_type(to_type, new_loc)   
+        past_ids = self._flat_indices(dynamic_output.past_locations)
+        new_ids = self._flat_indices(dynamic_output.new_locations)
+        to_types = self.get_vertex_types(past_ids)
+        from_types = self.get_vertex_types(new_ids)
+        self.set_vertex_types(to_types, new_ids)
+        self.world_hash ^= int(np.bitwise_xor.reduce(self._get_zobrist_keys(new_ids, from_types) 
+                                                     ^ self._get_zobrist_keys(new_ids, to_types)))
+        if self._neigh_type_matrix is not None:
+            changed = from_types != to_types
+            reverse_indptr, reverse_indices = self._get_reverse_neighbourhood()
+            owner, rows = _gather_csr_rows(reverse_indptr, reverse_indices, new_ids[changed])
+            weights = np.ones(len(rows), dtype=self._neigh_type_matrix.dtype)
+            if self._reverse_neighbourhood_weights is not None:
+                _, weights = _gather_csr_rows(reverse_indptr, self._reverse_neighbourhood_weights, new_ids[changed])
+            # the counts may be unsigned: they are decremented with subtract
+            for update, types in [(np.subtract, from_types[changed][owner]), (np.add, to_types[changed][owner])]:
+                is_occupied = types != EMPTY
+                update.at(self._neigh_type_matrix, (rows[is_occupied], types[is_occupied]), weights[is_occupied])
+            if self._placement_utility_matrix is not None:
+                utility, placement_utility_matrix = self._placement_utility_matrix
+                rows = np.unique(rows)
+                placement_utility_matrix[rows] = self._compute_placement_utilities(utility, rows)
 
     def step(self):
         '''
             Run the simulation for one step.
+            If the new world was already seen in the last `history_size` moves, 
+            the simulation is done (see `cycle_period`).
 
             Return:
                 True if changed.
@@ -243,12 +859,80 @@ class BaseGraphEnvironment(ABC):
                 self.done = True
                 return False
             self.move_vertices(response)
+            self._record_world()
             if self.verbosity > 0:
-                print('Moving vertex at', response.past_locations, 'to', response.new_locations)
+                print('Moving vertex at', self.get_location(response.past_locations), 
+                      'to', self.get_location(response.new_locations))
                 print(self.world)
             return True
         return False
         
+    def _get_checkpoint_path(self, path: str = None):
+        if path is None:
+            if self.memmap_dir is None:
+                raise ValueError('A checkpoint path is needed without memmap_dir.')
+            path = os.path.join(self.memmap_dir, 'checkpoint')
+        return path
+
+    def save_checkpoint(self, path: str = None):
+        '''
+            Save a copy of the world, of the neighbourhood-type matrix (if computed) 
+            and of the move counters to a directory. The history of the world hashes is not saved.
+
+            Args:
+                path: (optional) directory of the checkpoint, by default `memmap_dir`/checkpoint
+        '''
+        path = self._get_checkpoint_path(path)
+        os.makedirs(path, exist_ok=True)
+        for name, array in [('world', self._world), ('neigh_type_matrix', self._neigh_type_matrix)]:
+            if array is None:
+                continue
+            if isinstance(array, np.memmap):
+                array.flush()
+            np.save(os.path.join(path, name + '.npy'), array)
+        state = {
+            'num_types': self.num_types,
+            'num_moves': self.num_moves,
+            'done': self.done,
+            'cycle_period': self.cycle_period,
+            'has_neigh_type_matrix': self._neigh_type_matrix is not None
+        }
+        with open(os.path.join(path, 'checkpoint.json'), 'w') as json_data:
+            json.dump(state, json_data)
+
+    def load_checkpoint(self, path: str = None):
+        '''
+            Restore the state saved by `save_checkpoint`, without computing 
+            the neighbourhood-type matrix again. The arrays are read in memory, 
+            or copied to `memmap_dir` if it is set.
+            The history of the world hashes starts again from the restored world.
+
+            Args:
+                path: (optional) directory of the checkpoint, by default `memmap_dir`/checkpoint
+        '''
+        path = self._get_checkpoint_path(path)
+        with open(os.path.join(path, 'checkpoint.json'), 'r') as json_data:
+            state = json.load(json_data)
+        if state['num_types'] != self.num_types:
+            raise ValueError('The checkpoint has %d types, the environment %d.' % (state['num_types'], self.num_types))
+        # the arrays are streamed from the files when they are copied to memmap_dir
+        mmap_mode = None if self.memmap_dir is None else 'r'
+        world = np.load(os.path.join(path, 'world.npy'), mmap_mode=mmap_mode)
+        if world.size != self.num_vertices:
+            raise ValueError('The checkpoint has %d vertices, the environment %d.' % (world.size, self.num_vertices))
+        self.world = world
+        if state['has_neigh_type_matrix']:
+            neigh_type_matrix = np.load(os.path.join(path, 'neigh_type_matrix.npy'), mmap_mode=mmap_mode)
+            if self.memmap_dir is not None:
+                target = self._get_memmap('neigh_type_matrix', neigh_type_matrix.shape, neigh_type_matrix.dtype)
+                target[...] = neigh_type_matrix
+                neigh_type_matrix = target
+            self._neigh_type_matrix = neigh_type_matrix
+        self.num_moves = state['num_moves']
+        self.done = state['done']
+        self.cycle_period = state['cycle_period']
+        self._history = {self.world_hash: self.num_moves}
+
     def compute_metric_summary(self, print_results:bool=False, to_str:bool=False):
         '''
             Get a summary of all metrics for the current time step.
@@ -1,9 +1,9 @@
 from __future__ import annotations
 import numpy as np 
-import copy
-from itertools import combinations_with_replacement
+from itertools import product
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+import scipy.sparse
 
 from graph_envs.base_graph_env import BaseGraphEnvironment, Vertex
 
@@ -11,6 +11,49 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from dynamics.base_dynamic import DynamicsOutput
 
+# the kernel weights are rounded to multiples of 2^-KERNEL_PRECISION_BITS, so that 
+# the weighted counts are exact sums in float, whatever the order of the additions
+KERNEL_PRECISION_BITS = 20
+
+
+def _distance_grid(radius: int, num_idx: int):
+    '''
+        Euclidean distance to the centre of the locations of the box of half-width radius.
+    '''
+    offsets = np.indices((2*radius+1,)*num_idx) - radius
+    return np.sqrt(np.sum(offsets**2, axis=0))
+
+
+def gaussian_kernel(radius: int, sigma: float, num_idx: int = 2):
+    '''
+        Neighbourhood kernel decaying as a Gaussian of the distance, 
+        with weight 1 at distance 1 (and 0 at the centre).
+
+        Args:
+            radius: half-width of the kernel
+            sigma: standard deviation, in locations
+            num_idx: number of dimensions of the world
+    '''
+    distances = _distance_grid(radius, num_idx)
+    kernel = np.exp(-(distances**2 - 1) / (2 * sigma**2))
+    kernel[(radius,)*num_idx] = 0
+    return kernel
+
+
+def inverse_distance_kernel(radius: int, power: float = 1, num_idx: int = 2):
+    '''
+        Neighbourhood kernel decaying as distance^-power, 
+        with weight 1 at distance 1 (and 0 at the centre).
+
+        Args:
+            radius: half-width of the kernel
+            power: decay exponent
+            num_idx: number of dimensions of the world
+    '''
+    distances = _distance_grid(radius, num_idx)
+    distances[(radius,)*num_idx] = np.inf
+    return distances**-float(power)
+
 
 class GridWorld(BaseGraphEnvironment):
     '''
@@ -23,11 +66,17 @@ class GridWorld(BaseGraphEnvironment):
                  *args, 
                  vertex_degree:int=4, 
                  wrapped_indices:bool|list=True, 
+                 neighbour_kernel:np.ndarray=None,
                  **kwargs):
         '''
             Args:
                 world_size: the size of the world (ndarray)
                 vertex_degree: the degree of each vertex
+                neighbour_kernel: (optional) np.array with an odd size along each index, 
+                                  the weight of the location at each offset from its centre 
+                                  (see `gaussian_kernel` and `inverse_distance_kernel`).
+                                  If given, the neighbourhood-type vectors are the weighted 
+                                  counts of the types over the kernel instead of `neigh_radius`.
         '''
         if isinstance(world_size, int):
             world_size = [world_size]
@@ -38,86 +87,309 @@ class GridWorld(BaseGraphEnvironment):
         else:
             assert(len(wrapped_indices) == len(world_size))
         self.wrapped_indices = wrapped_indices
-        num_vertices = np.prod(self.world_size)
+        self.neighbour_kernel = None
+        if neighbour_kernel is not None:
+            neighbour_kernel = np.array(neighbour_kernel, dtype=float)
+            if neighbour_kernel.ndim != len(world_size) or any(size % 2 == 0 for size in neighbour_kernel.shape):
+                raise ValueError('The neighbour kernel must have an odd size along each of the %d indices, got %s.' % (
+                    len(world_size), str(neighbour_kernel.shape)))
+            # the neighbourhood is open: the centre does not count
+            neighbour_kernel[tuple(size // 2 for size in neighbour_kernel.shape)] = 0
+            scale = 2.**KERNEL_PRECISION_BITS
+            self.neighbour_kernel = np.round(neighbour_kernel * scale) / scale
+        num_vertices = int(np.prod(self.world_size))
+        self._build_neighbour_index(num_vertices)
         super().__init__(num_vertices, num_vertices*vertex_degree/2, *args, **kwargs)
         
-    def __convert_index(self, location_1D):
+    def get_location(self, loc_ids: int|np.ndarray):
         '''
-            Convert 1D location index to n-D location index. 
-        '''						
-        l = len(self.world_size)
-        if l == 1:
-            return [location_1D]
-        location_nD = np.zeros(l)
-
-        for i in range(l-1):
-            cur_size = np.prod(self.world_size[i+1:])
-            location_nD[i] = location_1D // cur_size
-            location_1D = location_1D % cur_size
-        location_nD[-1] = location_1D
-        return location_nD
-    
+            Convert flat location ids to n-D location indices 
+            (for visualization and output only).
+
+            Return:
+                list of n-D indices for a single id, 
+                np.array of shape (len(loc_ids), n) otherwise
+        '''
+        if np.ndim(loc_ids) == 0:
+            return list(map(int, np.unravel_index(int(loc_ids), self.world_size)))
+        return np.stack(np.unravel_index(np.asarray(loc_ids, dtype=np.int64), self.world_size), axis=-1)
+
     def get_vertex(self, loc_idx: int|list):
-        if isinstance(loc_idx, int):
-            loc_idx = self.__convert_index(loc_idx)
+        loc_id = self._flat_index(loc_idx)
         return Vertex(
-                loc_idx=loc_idx,
-                type=self.get_vertex_type(loc_idx)
+                loc_idx=loc_id,
+                type=self._flat_world[loc_id]
             )
 
     def get_vertex_type(self, loc_idx: int|list):
-        if isinstance(loc_idx, int):
-            loc_idx = self.__convert_index(loc_idx)
-        v_type = self.world
-        for idx in loc_idx:
-            v_type = v_type[int(idx)]
-        return v_type
+        return self._flat_world[self._flat_index(loc_idx)]
 
     def set_vertex_type(self, given_type: int, loc_idx: int|list):
-        if isinstance(loc_idx, int):
-            loc_idx = self.__convert_index(loc_idx)
-        v_type = self.world
-        for idx in loc_idx[:-1]:
-            v_type = v_type[int(idx)]
-        v_type[int(loc_idx[-1])] = given_type
+        self._flat_world[self._flat_index(loc_idx)] = given_type
+
+    def _get_kernel_offsets(self):
+        '''
+            Get the offsets of the non-zero weights of the neighbour kernel, with their weights.
+            On the indices that are not wrapped, the offsets reaching beyond the world are dropped.
+
+            Return:
+                (offsets, weights): np.array of shape (num_offsets, num_idx), np.array of weights
+        '''
+        half_widths = np.array(self.neighbour_kernel.shape) // 2
+        offsets = np.argwhere(self.neighbour_kernel != 0)
+        weights = self.neighbour_kernel[tuple(offsets.T)]
+        offsets = offsets - half_widths
+        is_inside = np.all((np.abs(offsets) < np.array(self.world_size)) | np.array(self.wrapped_indices), axis=1)
+        return offsets[is_inside], weights[is_inside]
+
+    def _get_neighbourhood(self):
+        '''
+            With a neighbour kernel, the neighbourhood of a vertex is the set of the locations 
+            at the offsets of its non-zero weights (`_neighbourhood_weights` keeps the weights). 
+            A location reached through several offsets of a wrapped index counts with 
+            the sum of their weights.
+        '''
+        if self.neighbour_kernel is None or self._neighbourhood is not None:
+            return super()._get_neighbourhood()
+        offsets, weights = self._get_kernel_offsets()
+        coords = np.indices(self.world_size).reshape(len(self.world_size), -1)
+        world_size = np.array(self.world_size)[:, None]
+        wrapped = np.array(self.wrapped_indices)[:, None]
+        rows, cols, entry_weights = [], [], []
+        for offset, weight in zip(offsets, weights.tolist()):
+            cur_idx = coords + offset[:, None]
+            valid = ~np.any(((cur_idx < 0) | (cur_idx >= world_size)) & ~wrapped, axis=0)
+            cur_idx = np.mod(cur_idx[:, valid], world_size)
+            rows.append(np.flatnonzero(valid))
+            cols.append(np.ravel_multi_index(tuple(cur_idx), self.world_size))
+            entry_weights.append(np.full(len(rows[-1]), weight))
+        neighbourhood = scipy.sparse.csr_matrix(
+            (np.concatenate(entry_weights), (np.concatenate(rows), np.concatenate(cols))), 
+            shape=(self.num_vertices, self.num_vertices))
+        neighbourhood.sum_duplicates()
+        self._neighbourhood = (neighbourhood.indptr.astype(np.int64), neighbourhood.indices.astype(np.int64))
+        self._neighbourhood_weights = neighbourhood.data
+        return self._neighbourhood
+
+    def _compute_kernel_counts(self, out: np.ndarray):
+        '''
+            Count the types weighted by the neighbour kernel around every location at once, 
+            as the correlation of each one-hot type plane with the kernel, computed by FFT. 
+            The wrapped indices are periodic, and the others are zero-padded 
+            so that the kernel does not wrap around them.
+            The counts are rounded back to the precision of the kernel weights, 
+            which removes the floating-point noise of the FFT.
+        '''
+        offsets, weights = self._get_kernel_offsets()
+        half_widths = np.max(np.abs(offsets), axis=0, initial=0)
+        shape = [size if is_wrapped else size + int(half_width) 
+                 for size, is_wrapped, half_width in zip(self.world_size, self.wrapped_indices, half_widths)]
+        # circular kernel: the weight of offset o is at -o modulo the padded shape
+        kernel = np.zeros(shape)
+        np.add.at(kernel, tuple(np.mod(-offsets, shape).T), weights)
+        kernel = np.fft.rfftn(kernel)
+        scale = 2.**KERNEL_PRECISION_BITS
+        for t in range(self.num_types):
+            one_hot = np.pad((self.world == t).astype(float), 
+                             [(0, padded - size) for padded, size in zip(shape, self.world_size)])
+            counts = np.fft.irfftn(np.fft.rfftn(one_hot) * kernel, s=shape, axes=range(len(shape)))
+            counts = counts[tuple(slice(0, size) for size in self.world_size)]
+            out[:, t] = (np.round(counts * scale) / scale).reshape(-1)
+        return out
+
+    def _get_box_half_width(self):
+        '''
+            Get the half-width h if the neighbourhood of every vertex is the box of 
+            (2h+1)^n locations around it (without itself), None otherwise.
+            This is the case on a fully wrapped world whose immediate neighbours form a box 
+            (e.g. vertex_degree=8 or 24 in 2-D), if the box of radius `neigh_radius` 
+            does not wrap onto itself.
+        '''
+        if self._neighbour_stencil is None:
+            return None
+        num_idx = len(self.world_size)
+        width = int(np.max(np.abs(self._neighbour_stencil)))
+        box = set(product(range(-width, width+1), repeat=num_idx)) - {(0,)*num_idx}
+        if set(map(tuple, self._neighbour_stencil)) != box:
+            return None
+        half_width = width * self.neigh_radius
+        if any(size < 2*half_width+1 for size in self.world_size):
+            return None
+        return half_width
+
+    def _compute_box_counts(self, half_width: int, out: np.ndarray):
+        '''
+            Count the types in the box of half-width half_width around every location at once,
+            from the integral image (summed-area table) of each one-hot type plane, padded by 
+            wrapping: each box sum takes 2^n lookups, whatever its size.
+        '''
+        num_idx = self.world.ndim
+        width = 2*half_width + 1
+        for t in range(self.num_types):
+            one_hot = (self.world == t).astype(np.int64)
+            integral = np.pad(one_hot, half_width, mode='wrap')
+            for axis in range(num_idx):
+                integral = np.cumsum(integral, axis=axis)
+            integral = np.pad(integral, [(1, 0)]*num_idx)
+            counts = -one_hot
+            for corner in product([0, 1], repeat=num_idx):
+                index = tuple(slice(width, width+size) if is_upper else slice(0, size) 
+                              for is_upper, size in zip(corner, self.world_size))
+                counts += (-1)**(num_idx - sum(corner)) * integral[index]
+            out[:, t] = counts.reshape(-1)
+        return out
+
+    def _get_count_dtype(self):
+        '''
+            Get the dtype of the neighbourhood-type matrix without building 
+            the neighbourhood index when its size is known from the stencil.
+        '''
+        if self.neighbour_kernel is not None:
+            return np.dtype(float)
+        half_width = self._get_box_half_width()
+        if half_width is not None:
+            return np.min_scalar_type((2*half_width + 1)**len(self.world_size) - 1)
+        if self.neigh_radius <= 1 and self._neighbour_stencil is not None:
+            return np.min_scalar_type(len(self._neighbour_stencil))
+        return super()._get_count_dtype()
+
+    def _compute_neighborhood_type_matrix(self, out: np.ndarray = None):
+        '''
+            With a neighbour kernel, count the types by FFT convolution. 
+            If the neighbourhoods are boxes, count the types with summed-area tables. 
+            Otherwise, on a fully wrapped world every vertex has the same neighbour offsets, 
+            so the matrix is a sum of shifted one-hot type planes. 
+            Otherwise, fall back to the neighbourhood index.
+            The type planes are counted one at a time.
+        '''
+        if out is None:
+            out = np.empty((self.num_vertices, self.num_types), dtype=self._get_count_dtype())
+        if self.neighbour_kernel is not None:
+            return self._compute_kernel_counts(out)
+        half_width = self._get_box_half_width()
+        if half_width is not None:
+            return self._compute_box_counts(half_width, out)
+        if self.neigh_radius > 1 or self._neighbour_stencil is None:
+            return super()._compute_neighborhood_type_matrix(out)
+        for t in range(self.num_types):
+            one_hot = (self.world == t).astype(out.dtype)
+            counts = np.zeros_like(one_hot)
+            for offset in self._neighbour_stencil:
+                counts += np.roll(one_hot, [-o for o in offset], axis=tuple(range(one_hot.ndim)))
+            out[:, t] = counts.reshape(-1)
+        return out
+
+    def get_vertex_types(self, loc_ids: np.ndarray):
+        return self._flat_world[loc_ids]
+
+    def set_vertex_types(self, given_types: np.ndarray, loc_ids: np.ndarray):
+        self._flat_world[loc_ids] = given_types
 
     def get_max_degree(self):
         return self.vertex_degree
 
     def sample_vertices(self, num_samples: int = 1):
         '''
-            Sample vertices in 1D and convert locations into n-D
+            Sample vertices by flat location id
         '''
         chosen_location_1Ds = np.random.choice(self.num_vertices, num_samples, replace=False)
-        loc_idx_list = [list(map(int, self.__convert_index(location_1D))) 
-                        for location_1D in chosen_location_1Ds] 
-        return [self.get_vertex(loc_idx) for loc_idx in loc_idx_list]
+        return [self.get_vertex(int(loc_id)) for loc_id in chosen_location_1Ds]
     
-    def _wraped_index(self, loc_idx: list):
+    def _flat_index(self, loc_idx: int|list):
+        if isinstance(loc_idx, (int, np.integer)):
+            return int(loc_idx)
+        return int(np.ravel_multi_index(tuple(map(int, loc_idx)), self.world_size))
+
+    def _neighbour_offsets(self):
         '''
-            Wrap the location index. Return None if it not allowed to wrap if needed.
+            Generate the relative location offsets of the neighbours 
+            in the order they are visited (see `get_immediate_neighbours`).
         '''
-        for i in range(len(loc_idx)):
-            if loc_idx[i] < 0:
-                if not self.wrapped_indices[i]:
-                    return None
-                loc_idx[i] = self.world_size[i] + loc_idx[i]
-            elif loc_idx[i] >= self.world_size[i]:
-                if not self.wrapped_indices[i]:
-                    return None
-                loc_idx[i] = loc_idx[i] - self.world_size[i]
-        return loc_idx
-    
+        num_idx = len(self.world_size)
+        for w in range(1, np.min(self.world_size)):
+            # the +-cross part
+            for i in range(num_idx):
+                for new_idx in [-w, w]:
+                    offset = [0]*num_idx
+                    offset[i] = new_idx
+                    yield offset
+            # the x-cross part
+            for i in range(num_idx):
+                # fix one index to -w or w
+                for new_idx in [-w, w]:
+                    # assign the left indices to numbers between [-w+1, w-1]
+                    # assign the right indices to numbers between [-w, w]
+                    # (all the combinations of values, in 3 or more indices)
+                    left_numbs, right_numbs = [[]], [[]]
+                    if i > 0:
+                        left_numbs = np.stack(list(product(range(w*2-1), repeat=i))) - w+1
+                    if num_idx-i > 1:
+                        right_numbs = np.stack(list(product(range(w*2+1), repeat=num_idx-i-1))) - w
+                    for l_idx in left_numbs:
+                        for r_idx in right_numbs:
+                            numbs = list(set(list(l_idx) + list(r_idx)))
+                            if len(numbs) == 0 or (numbs[0] == 0 and len(numbs) == 1):
+                                continue
+                            yield list(map(int, l_idx)) + [new_idx] + list(map(int, r_idx))
+
+    def _build_neighbour_index(self, num_vertices: int):
+        '''
+            Build the neighbour index once for all vertices.
+
+            `self.neighbour_index` is a dense (num_vertices, vertex_degree) table of
+            flat neighbour ids in visiting order, padded with -1 when a location 
+            is reached twice through wrapped indices. The same ids are kept 
+            in CSR form in `self.neighbour_indptr` and `self.neighbour_indices`.
+        '''
+        coords = np.indices(self.world_size).reshape(len(self.world_size), -1)
+        world_size = np.array(self.world_size)[:, None]
+        wrapped = np.array(self.wrapped_indices)
+        neighbour_index = np.full((num_vertices, self.vertex_degree), -1, dtype=np.int64)
+        degree = np.zeros(num_vertices, dtype=np.int64)
+        stencil = []
+        for offset in self._neighbour_offsets():
+            if np.all(degree == self.vertex_degree):
+                break
+            stencil.append(offset)
+            cur_idx = coords + np.array(offset)[:, None]
+            outside = (cur_idx < 0) | (cur_idx >= world_size)
+            valid = (degree < self.vertex_degree) & ~np.any(outside & ~wrapped[:, None], axis=0)
+            cur_idx = np.mod(cur_idx, world_size)
+            rows = np.flatnonzero(valid)
+            neigh_ids = np.ravel_multi_index(tuple(cur_idx[:, rows]), self.world_size)
+            # a location reached twice still counts towards the degree
+            # (only possible if a wrapped index is at most twice as long as the offsets)
+            is_new = np.ones(len(rows), dtype=bool)
+            if np.any(wrapped & (world_size[:, 0] <= 2*np.max(np.abs(stencil)))):
+                is_new = ~np.any(neighbour_index[rows] == neigh_ids[:, None], axis=1)
+            neighbour_index[rows[is_new], degree[rows[is_new]]] = neigh_ids[is_new]
+            degree[rows] += 1
+        if np.any(degree < self.vertex_degree):
+            print('Warning! Only found %d degree for world size:' % np.min(degree), self.world_size)
+        self.neighbour_index = neighbour_index
+        # the offsets shared by all vertices, if the world is fully wrapped
+        self._neighbour_stencil = None
+        if all(self.wrapped_indices) and np.all(neighbour_index >= 0):
+            self._neighbour_stencil = stencil
+        is_neighbour = neighbour_index >= 0
+        self.neighbour_indptr = np.concatenate([[0], np.cumsum(np.sum(is_neighbour, axis=1))])
+        if np.all(is_neighbour):
+            # no padding: the CSR indices are a view of the dense table
+            self.neighbour_indices = neighbour_index.reshape(-1)
+        else:
+            self.neighbour_indices = neighbour_index[is_neighbour]
+
     def get_immediate_neighbours(self, vertex: Vertex, as_dict=False):
         '''
             Get the immediate neighbours of a vertex. 
-            It will iterate through all possible neighbors
+            The neighbours are read from the neighbour index, which 
+            is built once by iterating through all possible neighbors
             until it reaches `vertex_degree` number of
             visited neighbors. 
             
             Args:
                 vertex: reference vertex
-                as_dict: (optional) return as a dictionary with key=loc_idx
+                as_dict: (optional) return as a dictionary with key=loc_idx (flat id)
 
             Return:
                 list or dict of Vertex
@@ -167,60 +439,12 @@ class GridWorld(BaseGraphEnvironment):
                 [3, 4]
             ```
         '''
-        loc_idx = vertex.loc_idx
-        num_idx = len(loc_idx)
         neigh_vertices = {}
-
-        def __return_neigh_vertices():
-            if as_dict:
-                return neigh_vertices
-            return neigh_vertices.values()
-    
-        def __add_vertex(cur_idx, degree):
-            cur_idx = self._wraped_index(cur_idx)
-            if cur_idx is not None:
-                v = self.get_vertex(cur_idx)
-                neigh_vertices[tuple(v.loc_idx)] = v
-                degree += 1
-            return degree
-
-        degree = 0
-        for w in range(1, np.min(self.world_size)):
-            # the +-cross part
-            for i in range(num_idx):
-                for new_idx in [-w, w]:
-                    cur_idx = copy.copy(loc_idx)
-                    cur_idx[i] += new_idx
-                    degree = __add_vertex(cur_idx, degree)
-                    if degree == self.vertex_degree: 
-                        return __return_neigh_vertices()
-            # the x-cross part
-            for i in range(num_idx):
-                # fix one index to -w or w
-                for new_idx in [-w, w]:
-                    # assign the left indices to numbers between [-w+1, w-1]
-                    # assign the right indices to numbers between [-w, w]
-                    left_numbs, right_numbs = [[]], [[]]
-                    if w > 1 and i > 0:
-                        left_numbs = np.stack(list(combinations_with_replacement(range(w*2-1), i))) - w+1
-                    if num_idx-i > 1:
-                        right_numbs = np.stack(list(combinations_with_replacement(range(w*2+1), num_idx-i-1))) - w
-                    for l_idx in left_numbs:
-                        for r_idx in right_numbs:
-                            numbs = list(l_idx) + list(r_idx) 
-                            if len(numbs) == 0:
-                                continue
-                            numbs = list(set(numbs))
-                            if numbs[0] == 0 and len(numbs) == 1:
-                                continue
-                            cur_idx = np.array(list(l_idx) + [new_idx] + list(r_idx)) + np.array(vertex.loc_idx)
-                            degree = __add_vertex(cur_idx.tolist(), degree)
-                            if degree == self.vertex_degree: 
-                                return __return_neigh_vertices()
-    
-        if degree < self.vertex_degree: 
-            print('Warning! Only found %d degree for world size:' % degree, self.world_size)
-        return __return_neigh_vertices()
+        for neigh_id in self.get_neighbour_ids(vertex.loc_idx).tolist():
+            neigh_vertices[neigh_id] = self.get_vertex(neigh_id)
+        if as_dict:
+            return neigh_vertices
+        return neigh_vertices.values()
     
     def save_snapshot(self, step_n, fig_name):
         fig, ax = plt.subplots()
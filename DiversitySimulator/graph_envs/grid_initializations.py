@@ -5,9 +5,10 @@ import json
 import copy
 import numpy as np
 
+from utilities.base_utility import EMPTY
 from utilities.neighborhood_vector_metrics import SchellingSegregationUtility
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 if TYPE_CHECKING:   
     from graph_envs.base_graph_env import BaseGraphEnvironment
 
@@ -23,6 +24,10 @@ def _get_init_file_path(env: BaseGraphEnvironment):
         world_size = (world_size,)
     file_path = '%s/%d-types_size-%s.json' % (ROOT, env.num_types, 
                                               '-'.join(list(map(str, world_size))))
+    graph_name = getattr(env, 'graph_name', None)
+    if graph_name is not None:
+        file_path = '%s/%s_%d-types_size-%s.json' % (ROOT, graph_name, env.num_types, 
+                                                     '-'.join(list(map(str, world_size))))
     return file_path
 
 
@@ -122,3 +127,19 @@ def schelling_segregation_init(env: BaseGraphEnvironment, rs:int = -1):
             _save_init(env, 'schelling_segregation_init', rs)
     else:
         init_func()
+
+
+def vacancy_init(vacancy_rate: float, init_func: Callable = random_init):
+    '''
+        Make an initialization that runs init_func and then empties 
+        round(vacancy_rate * num_vertices) random locations (type EMPTY).
+    '''
+    def init_vacancies(env: BaseGraphEnvironment, rs:int = -1):
+        init_func(env, rs)
+        rng = np.random.default_rng(rs if rs >= 0 else None)
+        num_vacancies = int(round(vacancy_rate*env.num_vertices))
+        world = env.world.copy()
+        world.reshape(-1)[rng.choice(env.num_vertices, num_vacancies, replace=False)] = EMPTY
+        env.world = world
+
+    return init_vacancies
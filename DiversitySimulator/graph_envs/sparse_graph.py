@@ -0,0 +1,261 @@
+from __future__ import annotations
+import os.path
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+
+from graph_envs.base_graph_env import BaseGraphEnvironment, Vertex
+
+
+def edges_to_csr(edges: np.ndarray, num_vertices: int = None):
+    '''
+        Build the CSR adjacency of an undirected simple graph from its edges.
+        Self-loops and repeated edges are dropped.
+
+        Args:
+            edges: np.array of shape (num_edges, 2) of vertex ids
+            num_vertices: (optional) number of vertices, by default 1 + the largest vertex id
+
+        Return:
+            (indptr, indices), with the neighbours of each vertex sorted
+    '''
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if num_vertices is None:
+        num_vertices = int(np.max(edges, initial=-1)) + 1
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    keys = np.unique(np.concatenate([edges[:, 0] * num_vertices + edges[:, 1],
+                                     edges[:, 1] * num_vertices + edges[:, 0]]))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(keys // num_vertices, minlength=num_vertices))])
+    return indptr.astype(np.int64), keys % num_vertices
+
+
+def random_regular_graph(num_vertices: int, degree: int, seed: int = None, max_iter: int = 1000):
+    '''
+        Random degree-regular graph: the stubs of the configuration model are paired at random,
+        and the self-loops and repeated edges are removed by random double-edge swaps.
+    '''
+    if num_vertices * degree % 2 != 0 or degree >= num_vertices:
+        raise ValueError('No %d-regular graph with %d vertices.' % (degree, num_vertices))
+    rng = np.random.default_rng(seed)
+    edges = rng.permutation(np.repeat(np.arange(num_vertices), degree)).reshape(-1, 2)
+    for _ in range(max_iter):
+        keys = np.minimum(edges[:, 0], edges[:, 1]) * num_vertices + np.maximum(edges[:, 0], edges[:, 1])
+        order = np.argsort(keys, kind='stable')
+        is_bad = edges[:, 0] == edges[:, 1]
+        is_bad[order[1:]] |= keys[order[1:]] == keys[order[:-1]]
+        bad = np.flatnonzero(is_bad)
+        if len(bad) == 0:
+            return edges_to_csr(edges, num_vertices)
+        # swap (a, b), (c, d) -> (a, c), (b, d), each edge being in at most one swap
+        pairs = np.stack([bad, rng.integers(len(edges), size=len(bad))], axis=1)
+        is_used_once = np.bincount(pairs.reshape(-1), minlength=len(edges))[pairs] == 1
+        pairs = pairs[np.all(is_used_once, axis=1)]
+        b, c = edges[pairs[:, 0], 1].copy(), edges[pairs[:, 1], 0].copy()
+        edges[pairs[:, 0], 1] = c
+        edges[pairs[:, 1], 0] = b
+    raise ValueError('Could not build a simple %d-regular graph in %d iterations.' % (degree, max_iter))
+
+
+def erdos_renyi_graph(num_vertices: int, edge_prob: float, seed: int = None):
+    '''
+        Erdős–Rényi graph G(n, p): a binomial number of distinct pairs, drawn uniformly
+        and decoded from their index in the list of pairs (j < i).
+    '''
+    rng = np.random.default_rng(seed)
+    num_pairs = num_vertices * (num_vertices - 1) // 2
+    pair_ids = rng.choice(num_pairs, rng.binomial(num_pairs, edge_prob), replace=False)
+    # pair_id = i (i - 1) / 2 + j
+    i = ((1 + np.sqrt(8 * pair_ids.astype(float) + 1)) / 2).astype(np.int64)
+    i -= i * (i - 1) // 2 > pair_ids
+    i += (i + 1) * i // 2 <= pair_ids
+    j = pair_ids - i * (i - 1) // 2
+    return edges_to_csr(np.stack([i, j], axis=1), num_vertices)
+
+
+def watts_strogatz_graph(num_vertices: int, degree: int, rewire_prob: float, seed: int = None):
+    '''
+        Watts–Strogatz graph: a ring where each vertex is linked to its degree/2 nearest
+        vertices on each side, and each edge has its far end rewired to a uniform vertex
+        with probability rewire_prob (an edge is kept as it is if its rewiring
+        would create a self-loop or a repeated edge).
+    '''
+    rng = np.random.default_rng(seed)
+    sources = np.repeat(np.arange(num_vertices), degree // 2)
+    targets = (sources + np.tile(np.arange(1, degree // 2 + 1), num_vertices)) % num_vertices
+    rewired = np.flatnonzero(rng.random(len(sources)) < rewire_prob)
+    new_targets = rng.integers(num_vertices, size=len(rewired))
+    keys = np.minimum(sources, targets) * num_vertices + np.maximum(sources, targets)
+    new_keys = (np.minimum(sources[rewired], new_targets) * num_vertices
+                + np.maximum(sources[rewired], new_targets))
+    _, first = np.unique(new_keys, return_index=True)
+    is_valid = (new_targets != sources[rewired]) & ~np.isin(new_keys, keys)
+    is_valid &= np.isin(np.arange(len(rewired)), first)
+    targets[rewired[is_valid]] = new_targets[is_valid]
+    return edges_to_csr(np.stack([sources, targets], axis=1), num_vertices)
+
+
+def barabasi_albert_graph(num_vertices: int, num_links: int, seed: int = None):
+    '''
+        Barabási–Albert graph, with the linear-time algorithm of Batagelj and Brandes:
+        slot 2e of the list of edge ends is the new vertex of edge e = v * num_links + k,
+        and slot 2e + 1 copies a uniform earlier slot, so that vertices are picked
+        proportionally to their degree. The copies are resolved all at once by following
+        the chains of odd slots. Repeated edges are merged.
+    '''
+    rng = np.random.default_rng(seed)
+    num_slots = num_vertices * num_links
+    edge_ids = np.arange(num_slots)
+    copied = np.floor(rng.random(num_slots) * (2 * edge_ids + 1)).astype(np.int64)
+    slots = copied.copy()
+    is_odd = np.flatnonzero(slots % 2 == 1)
+    while len(is_odd) > 0:
+        slots[is_odd] = copied[slots[is_odd] // 2]
+        is_odd = is_odd[slots[is_odd] % 2 == 1]
+    sources = edge_ids // num_links
+    targets = slots // 2 // num_links
+    return edges_to_csr(np.stack([sources, targets], axis=1), num_vertices)
+
+
+def load_graph(path: str, mmap: bool = True):
+    '''
+        Load a graph in CSR form from:
+        - a directory with `indptr.npy` and `indices.npy` (see `save_graph`),
+          memory-mapped if mmap (for graphs with millions of vertices)
+        - a `.npz` file with the arrays `indptr` and `indices`, or `edges`
+        - a text edge list, one `source target` pair per line (`#` for comments)
+
+        Return:
+            (indptr, indices)
+    '''
+    if os.path.isdir(path):
+        mmap_mode = 'r' if mmap else None
+        return (np.load(os.path.join(path, 'indptr.npy'), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, 'indices.npy'), mmap_mode=mmap_mode))
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            if 'edges' in data:
+                return edges_to_csr(data['edges'])
+            return data['indptr'], data['indices']
+    return edges_to_csr(np.loadtxt(path, dtype=np.int64, comments='#', usecols=(0, 1), ndmin=2))
+
+
+def save_graph(path: str, indptr: np.ndarray, indices: np.ndarray):
+    '''
+        Save a graph in CSR form to a directory that `load_graph` can memory-map.
+    '''
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'indptr.npy'), np.asarray(indptr, dtype=np.int64))
+    np.save(os.path.join(path, 'indices.npy'), np.asarray(indices, dtype=np.int64))
+
+
+class SparseGraphEnvironment(BaseGraphEnvironment):
+    '''
+        Graph environment over an arbitrary undirected graph, given as its CSR adjacency
+        (the neighbours of vertex v are indices[indptr[v]:indptr[v+1]], and every edge
+        is stored in both directions). The vertices can have different degrees.
+        The world is the 1-D array of the types of the vertices.
+    '''
+
+    def __init__(self,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 *args,
+                 graph_name: str = None,
+                 **kwargs):
+        '''
+            Args:
+                indptr: np.array of length num_vertices + 1 
+                indices: np.array of the neighbour ids 
+                         (memory-mapped arrays are used without copy if they are int64)
+                graph_name: (optional) name of the graph, used to store the initializations
+        '''
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        num_vertices = len(indptr) - 1
+        self.world_size = [num_vertices]
+        self.graph_name = graph_name
+        self.neighbour_indptr = indptr
+        self.neighbour_indices = indices
+        self._max_degree = int(np.max(np.diff(indptr), initial=0))
+        super().__init__(num_vertices, len(indices) / 2, *args, **kwargs)
+
+    @classmethod
+    def from_file(cls, path: str, *args, mmap: bool = True, **kwargs):
+        '''
+            Build the environment from a graph file (see `load_graph`), named after the file.
+        '''
+        kwargs.setdefault('graph_name', os.path.splitext(os.path.basename(os.path.normpath(path)))[0])
+        return cls(*load_graph(path, mmap), *args, **kwargs)
+
+    def get_vertex(self, loc_idx: int):
+        loc_id = self._flat_index(loc_idx)
+        return Vertex(
+                loc_idx=loc_id,
+                type=self._flat_world[loc_id]
+            )
+
+    def get_vertex_type(self, loc_idx: int):
+        return self._flat_world[self._flat_index(loc_idx)]
+
+    def get_vertex_types(self, loc_ids: np.ndarray):
+        return self._flat_world[loc_ids]
+
+    def set_vertex_type(self, given_type: int, loc_idx: int):
+        self._flat_world[self._flat_index(loc_idx)] = given_type
+
+    def set_vertex_types(self, given_types: np.ndarray, loc_ids: np.ndarray):
+        self._flat_world[loc_ids] = given_types
+
+    def get_max_degree(self):
+        return self._max_degree
+
+    def get_degrees(self):
+        '''
+            Return:
+                np.array of the degree of each vertex
+        '''
+        return np.diff(self.neighbour_indptr)
+
+    def sample_vertices(self, num_samples: int = 1):
+        '''
+            Sample vertices by flat location id
+        '''
+        chosen_ids = np.random.choice(self.num_vertices, num_samples, replace=False)
+        return [self.get_vertex(int(loc_id)) for loc_id in chosen_ids]
+
+    def get_immediate_neighbours(self, vertex: Vertex, as_dict=False):
+        neigh_vertices = {}
+        for neigh_id in self.get_neighbour_ids(vertex.loc_idx).tolist():
+            neigh_vertices[neigh_id] = self.get_vertex(neigh_id)
+        if as_dict:
+            return neigh_vertices
+        return neigh_vertices.values()
+
+    def save_snapshot(self, step_n, fig_name):
+        fig, ax = plt.subplots()
+        ax.imshow(np.tile(self.world, (2,1)), aspect='auto')
+        ax.set_title('Step: %d' % (step_n))
+        plt.savefig(fig_name+'.png')
+
+    def visualize(self, num_steps:int, name:str=None):
+        '''
+            Animate the types of the vertices (in vertex id order) over num_steps steps.
+        '''
+        fig, ax = plt.subplots()
+        self.viz_metrics = self.compute_metric_summary(to_str=True)
+        self.save_snapshot(0, '%s_init'%(name))
+
+        def step_visualize(i):
+            if i>0 and i<num_steps and self.step():
+                self.viz_metrics = self.compute_metric_summary(to_str=True)
+            ax.imshow(np.tile(self.world, (2,1)), aspect='auto')
+            ax.set_title('Step: %d, %s' % (min(i, num_steps), self.viz_metrics))
+            if i == num_steps:
+                self.save_snapshot(i, '%s_final'%(name))
+            return ax,
+
+        ani = animation.FuncAnimation(fig, step_visualize, frames=num_steps+10, interval=1)
+        writer = animation.PillowWriter(fps=10,
+                                        metadata=dict(artist='Diversity Simulator'),
+                                        bitrate=1800)
+        ani.save('%s_simulation.gif'%(name), writer=writer)
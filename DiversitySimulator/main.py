@@ -4,7 +4,7 @@ from pathlib import Path
 from configs import CIRCLE_WORLD, CYLINDER_WORLD, GRID_4DEG_WORLD, GRID_8DEG_WORLD
 
 from graph_envs.grid_initializations import random_init, block_init, schelling_segregation_init
-from dynamics.swap import UtilityOrderedSwapper, get_condition_name, INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER
+from dynamics.swap import UtilityOrderedSwapper, get_condition_name, INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER, COLLECTIVE_GREATER
 from utilities.neighborhood_vector_metrics import BinaryDiversityUtility, TypeCountingDiversityUtility, DifferenceCountDiversityUtility, AntiSchellingSegregationUtility, EntropyDivertiyUtility, AvgDiffTypeCountingDiversityUtility
 
 
@@ -13,7 +13,7 @@ WORLDS = [CIRCLE_WORLD, CYLINDER_WORLD, GRID_4DEG_WORLD, GRID_8DEG_WORLD]
 # UTILITIES = [BinaryDiversityUtility, TypeCountingDiversityUtility, DifferenceCountDiversityUtility, EntropyDivertiyUtility]
 UTILITIES = [AvgDiffTypeCountingDiversityUtility]
 INITIALIZATIONS = ['random_init', 'schelling_init'] #'block_init',
-SWAP_CONDS = [INDIVIDUAL_GREATER] #, INDIVIDUAL_NO_WORSE, SUM_GREATER]
+SWAP_CONDS = [INDIVIDUAL_GREATER, COLLECTIVE_GREATER] #, INDIVIDUAL_NO_WORSE, SUM_GREATER]
 NUM_RUNS = 100
 NUM_TYPES = [2,3,4,5,6,7,8]
 
@@ -39,7 +39,9 @@ for NUM_TYPE in NUM_TYPES:
             for i in range(NUM_RUNS):
                 kwargs = {
                      'utility': utility,
-                     'swap_cond': swap_cond
+                     'swap_cond': swap_cond,
+                     # end the runs that cycle (see results[i]['cycle_period'])
+                     'history_size': 2**16
                 }
                 if initialization == 'block_init':
                     kwargs['grid_init'] = block_init
@@ -69,6 +71,7 @@ for NUM_TYPE in NUM_TYPES:
                 # world.compute_metric_summary(print_results=True)
                 results[i]['final'] = world.compute_metric_summary()
                 results[i]['steps'] = steps
+                results[i]['cycle_period'] = world.cycle_period
                 results[i]['final_world'] = world.world.tolist()
                 # print(world_class.__name__, utility.__name__, i, results[i])
                 # v = world.get_vertex([0,0])
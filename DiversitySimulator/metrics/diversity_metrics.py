@@ -7,6 +7,7 @@
 from __future__ import annotations
 import numpy as np
 
+from utilities.base_utility import EMPTY
 from utilities.neighborhood_vector_metrics import DifferenceCountDiversityUtility
 from utilities.neighborhood_vector_metrics import BinaryDiversityUtility, TypeCountingDiversityUtility, AntiSchellingSegregationUtility, EntropyDivertiyUtility
 
@@ -21,34 +22,39 @@ COUNT_TYPE_UTILITY = TypeCountingDiversityUtility()
 DIVERSITY_UTILITIES = [BinaryDiversityUtility(), TypeCountingDiversityUtility(), DifferenceCountDiversityUtility(), EntropyDivertiyUtility()]
 
 
+def _get_occupied_ids(graph: BaseGraphEnvironment):
+    '''
+        Flat location ids of the vertices that are not EMPTY (the vacancies are not counted).
+    '''
+    return np.flatnonzero(graph.get_vertex_types(np.arange(graph.num_vertices)) != EMPTY)
+
+
 def diff_degree_of_intergration(graph: BaseGraphEnvironment):
     '''
         DOI_k, the percentage of vertices with at least k neighbouring 
-        vertices of a different type to itself.
+        vertices of a different type to itself (among the vertices that are not EMPTY).
 
         Return:
             vector of DOI_k from k = 1 to max degree in the graph
     '''
-    doi = np.zeros(graph.get_max_degree())
-    for v in graph:
-        count = int(graph.compute_utility(v, COUNT_DIFF_UTILITY))
-        doi[:count] += 1
-    return doi/graph.num_vertices
+    occupied_ids = _get_occupied_ids(graph)
+    counts = graph.compute_utilities(COUNT_DIFF_UTILITY, loc_ids=occupied_ids).astype(int)
+    doi = np.sum(counts[:, None] > np.arange(graph.get_max_degree()), axis=0)
+    return doi/len(occupied_ids)
 
 
 def type_degree_of_intergration(graph: BaseGraphEnvironment):
     '''
         DOI_k, the percentage of vertices with at least k different neighbouring 
-        types that are different to itself.
+        types that are different to itself (among the vertices that are not EMPTY).
 
         Return:
             vector of DOI_k from k = 1 to number of type - 1
     '''
-    doi = np.zeros(min(graph.num_types-1, graph.get_max_degree()))
-    for v in graph:
-        count = int(graph.compute_utility(v, COUNT_TYPE_UTILITY))
-        doi[:count] += 1
-    return doi/graph.num_vertices
+    occupied_ids = _get_occupied_ids(graph)
+    counts = graph.compute_utilities(COUNT_TYPE_UTILITY, loc_ids=occupied_ids).astype(int)
+    doi = np.sum(counts[:, None] > np.arange(min(graph.num_types-1, graph.get_max_degree())), axis=0)
+    return doi/len(occupied_ids)
 
 
 def percentage_of_segregated_verticies(graph: BaseGraphEnvironment, doi_1: float =-1):
@@ -67,20 +73,32 @@ def percentage_of_segregated_verticies(graph: BaseGraphEnvironment, doi_1: float
 def number_of_colorful_edges(graph: BaseGraphEnvironment):
     '''
         The percentage of colorful edges, that is, 
-        connections between vertices of different type.
+        connections between vertices of different type
+        (the edges with an EMPTY vertex are not counted).
 
         The number of coloful edges is equivalent to half of the sum of 
         diff_DOI_k (number instead of percentage) over all k.
     '''
-    return np.sum(diff_degree_of_intergration(graph))*graph.num_vertices/graph.num_edges/2
+    occupied_ids = _get_occupied_ids(graph)
+    is_empty = np.ones(graph.num_vertices, dtype=bool)
+    is_empty[occupied_ids] = False
+    rows = np.repeat(np.arange(graph.num_vertices), np.diff(graph.neighbour_indptr))
+    # each edge is in the neighbour index of both of its vertices
+    num_empty_edges = np.count_nonzero(is_empty[rows] | is_empty[graph.neighbour_indices]) / 2
+    return np.sum(diff_degree_of_intergration(graph))*len(occupied_ids)/(graph.num_edges - num_empty_edges)/2
 
 
 def social_welfare(graph: BaseGraphEnvironment):
     '''
         Sum of utilities compared with the best and worst case
+        (the vacancies are not counted)
     '''
     utility_sum = np.zeros(len(DIVERSITY_UTILITIES))
-    for v in graph:
-        for i, util_method in enumerate(DIVERSITY_UTILITIES):
-            utility_sum[i] += graph.compute_utility(v, util_method) / util_method.best_case(v) 
-    return utility_sum/graph.num_vertices
+    occupied_ids = _get_occupied_ids(graph)
+    vertices = graph.get_vertex_block(occupied_ids)
+    for i, util_method in enumerate(DIVERSITY_UTILITIES):
+        best_cases = util_method.best_case_block(vertices)
+        # a vertex whose neighbours are all EMPTY (best case 0) adds 0
+        utility_sum[i] = np.sum(np.divide(util_method.compute_block(vertices), best_cases, 
+                                          out=np.zeros(len(best_cases)), where=best_cases != 0))
+    return utility_sum/len(occupied_ids)
@@ -6,6 +6,8 @@
 from __future__ import annotations
 import numpy as np
 
+from utilities.base_utility import EMPTY
+
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from graph_envs.base_graph_env import BaseGraphEnvironment
@@ -13,9 +15,7 @@ if TYPE_CHECKING:
 
 def social_welfare_metric(graph: BaseGraphEnvironment):
     '''
-        Sum of utilities of vertex in the graph environment. 
+        Sum of utilities of vertex in the graph environment (the vacancies are not counted). 
     '''
-    utility_sum = 0
-    for v in graph:
-        utility_sum += graph.compute_utility(v)
-    return utility_sum
+    utilities = graph.compute_utilities()
+    return np.sum(utilities[graph.get_vertex_types(np.arange(graph.num_vertices)) != EMPTY])
@@ -0,0 +1,92 @@
+'''
+    Shared fixtures of the tests.
+    The modules are imported relative to DiversitySimulator/, as in main.py,
+    and the tests run from the repository root (where the initializations are saved).
+'''
+import os
+import sys
+import numpy as np
+import pytest
+
+SIMULATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SIMULATOR_DIR)
+os.chdir(os.path.dirname(SIMULATOR_DIR))
+
+from dynamics.base_dynamic import DynamicsOutput
+from graph_envs.grid import GridWorld
+from utilities.base_utility import EMPTY
+from utilities.neighborhood_vector_metrics import EntropyDivertiyUtility
+
+
+@pytest.fixture
+def make_grid():
+    '''
+        Make a GridWorld with a random world drawn from seed,
+        with round(vacancy_rate * num_vertices) EMPTY locations.
+    '''
+    def _make_grid(world_size: list,
+                   seed: int = 0,
+                   vacancy_rate: float = 0.,
+                   num_types: int = 3,
+                   utility=None,
+                   dynamics=None,
+                   **kwargs):
+        def init_func(env, rs=-1):
+            rng = np.random.default_rng(seed)
+            world = rng.integers(num_types, size=world_size)
+            num_vacancies = int(round(vacancy_rate*world.size))
+            world.reshape(-1)[rng.choice(world.size, num_vacancies, replace=False)] = EMPTY
+            env.world = world
+
+        return GridWorld(world_size,
+                         num_types=num_types,
+                         utility=EntropyDivertiyUtility() if utility is None else utility,
+                         metrics=[],
+                         dynamics=dynamics,
+                         init_func=init_func,
+                         **kwargs)
+    return _make_grid
+
+
+@pytest.fixture
+def brute_force_swaps():
+    '''
+        Evaluate the swap condition on all the pairs of locations by moving the vertices:
+        the utilities after the swap are computed on the swapped world.
+        Under COLLECTIVE_GREATER, each of the two vertices can move if the majority of itself
+        and its occupied immediate neighbours is better off (a vacancy is never better off).
+
+        Return:
+            np.array of shape (num_pairs, 2) of the pairs (i < j) that can swap
+    '''
+    def _brute_force_swaps(env, swapper):
+        from dynamics.swap import COLLECTIVE_GREATER
+
+        utilities = env.compute_utilities()
+        types = env.get_vertex_types(np.arange(env.num_vertices))
+        accepted = []
+        for loc_id1 in range(env.num_vertices):
+            for loc_id2 in range(loc_id1+1, env.num_vertices):
+                if types[loc_id1] == types[loc_id2]:
+                    continue
+                swap = DynamicsOutput(past_locations=np.array([loc_id1, loc_id2]),
+                                      new_locations=np.array([loc_id2, loc_id1]),
+                                      is_end=False)
+                env.move_vertices(swap)
+                swapped_utilities = env.compute_utilities()
+                env.move_vertices(swap)
+                if swapper.swap_condition != COLLECTIVE_GREATER:
+                    is_accepted = swapper._is_improving(utilities[loc_id1], utilities[loc_id2],
+                                                        swapped_utilities[loc_id2], swapped_utilities[loc_id1])
+                else:
+                    is_accepted = True
+                    for mover, target in [(loc_id1, loc_id2), (loc_id2, loc_id1)]:
+                        neigh_ids = env.neighbour_indices[env.neighbour_indptr[mover]:env.neighbour_indptr[mover+1]]
+                        neigh_ids = neigh_ids[types[neigh_ids] != EMPTY]
+                        score = (swapped_utilities[target] > utilities[mover]) + \
+                            np.sum(swapped_utilities[neigh_ids] > utilities[neigh_ids])
+                        is_accepted &= score >= (len(neigh_ids)+1)/2
+                if is_accepted:
+                    accepted.append((loc_id1, loc_id2))
+        return np.array(accepted, dtype=np.int64).reshape(-1, 2)
+    return _brute_force_swaps
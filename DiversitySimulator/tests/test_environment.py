@@ -0,0 +1,49 @@
+import copy
+import pickle
+import numpy as np
+import pytest
+
+from dynamics.base_dynamic import BaseDynamics, DynamicsOutput
+from dynamics.swap import RandomSwapper, INDIVIDUAL_GREATER
+
+
+@pytest.mark.parametrize('make_copy', [copy.deepcopy, lambda env: pickle.loads(pickle.dumps(env))])
+def test_copies_keep_a_single_world(make_grid, make_copy):
+    env = make_grid([8, 8], dynamics=RandomSwapper(INDIVIDUAL_GREATER, batch_size=32, seed=0))
+    env.get_neighborhood_type_matrix()
+    world = env.world.copy()
+    env_copy = make_copy(env)
+    for _ in range(200):
+        env_copy.step()
+    assert not np.array_equal(env_copy.world, world)
+    np.testing.assert_array_equal(env.world, world)
+    # the world, its flat view and the counts of the copy move together
+    np.testing.assert_array_equal(env_copy.get_vertex_types(np.arange(env_copy.num_vertices)),
+                                  env_copy.world.reshape(-1))
+    counts = env_copy.get_neighborhood_type_matrix().copy()
+    env_copy.world = env_copy.world.copy()
+    np.testing.assert_array_equal(counts, env_copy.get_neighborhood_type_matrix())
+
+
+class _RotateDynamics(BaseDynamics):
+    '''
+        Rotate the types of a few locations at each step: the world cycles.
+    '''
+    def __init__(self, loc_ids):
+        self.loc_ids = np.array(loc_ids)
+
+    def step(self, env):
+        return DynamicsOutput(past_locations=self.loc_ids, new_locations=np.roll(self.loc_ids, 1), is_end=False)
+
+
+@pytest.mark.parametrize('history_size, cycle_period', [(0, None), (2, None), (3, 3), (2**16, 3)])
+def test_cycle_detection(make_grid, history_size, cycle_period):
+    env = make_grid([6, 6], seed=0, dynamics=None, history_size=history_size)
+    # one location of each type
+    loc_ids = [int(np.flatnonzero(env.world.reshape(-1) == t)[0]) for t in range(env.num_types)]
+    env.dynamics = _RotateDynamics(loc_ids)
+    num_steps = 0
+    while env.step() and num_steps < 10:
+        num_steps += 1
+    assert env.cycle_period == cycle_period
+    assert env.done == (cycle_period is not None)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+
+# the neighbours of each vertex in visiting order, as offsets from the vertex
+CROSS_2D = [[-1, 0], [1, 0], [0, -1], [0, 1]]
+BOX_2D = CROSS_2D + [[-1, -1], [-1, 1], [1, -1], [1, 1]]
+CROSS_3D = [[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]]
+NEIGHBOUR_OFFSETS = [
+    ([9], 2, [[-1], [1]]),
+    ([9], 6, [[-1], [1], [-2], [2], [-3], [3]]),
+    ([9, 9], 4, CROSS_2D),
+    ([9, 9], 8, BOX_2D),
+    ([9, 9], 12, BOX_2D + [[-2, 0], [2, 0], [0, -2], [0, 2]]),
+    ([9, 9], 24, BOX_2D + [[-2, 0], [2, 0], [0, -2], [0, 2],
+                           [-2, -2], [-2, -1], [-2, 1], [-2, 2], [2, -2], [2, -1], [2, 1], [2, 2],
+                           [-1, -2], [1, -2], [-1, 2], [1, 2]]),
+    ([7, 7, 7], 6, CROSS_3D),
+    ([7, 7, 7], 26, CROSS_3D + [[-1, -1, -1], [-1, -1, 0], [-1, -1, 1], [-1, 0, -1], [-1, 0, 1],
+                                [-1, 1, -1], [-1, 1, 0], [-1, 1, 1],
+                                [1, -1, -1], [1, -1, 0], [1, -1, 1], [1, 0, -1], [1, 0, 1],
+                                [1, 1, -1], [1, 1, 0], [1, 1, 1],
+                                [0, -1, -1], [0, -1, 1], [0, 1, -1], [0, 1, 1]]),
+]
+
+
+@pytest.mark.parametrize('world_size, vertex_degree, offsets', NEIGHBOUR_OFFSETS)
+def test_neighbour_offsets(make_grid, world_size, vertex_degree, offsets):
+    env = make_grid(world_size, vertex_degree=vertex_degree)
+    centre = [size//2 for size in world_size]
+    neigh_ids = env.get_neighbour_ids(centre)
+    neigh_locs = np.stack(np.unravel_index(neigh_ids, world_size), axis=1)
+    np.testing.assert_array_equal(neigh_locs - centre, offsets)
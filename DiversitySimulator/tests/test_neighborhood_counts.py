@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from dynamics.base_dynamic import DynamicsOutput
+from graph_envs.base_graph_env import BaseGraphEnvironment
+from graph_envs.grid import gaussian_kernel
+
+
+GRIDS = [
+    dict(world_size=[8, 8], vertex_degree=4, wrapped_indices=True),
+    dict(world_size=[9, 7], vertex_degree=8, wrapped_indices=[False, True]),
+    dict(world_size=[7, 7], vertex_degree=24, wrapped_indices=True),
+    dict(world_size=[20], vertex_degree=2, wrapped_indices=False),
+    dict(world_size=[5, 5, 5], vertex_degree=26, wrapped_indices=True),
+]
+
+
+@pytest.mark.parametrize('grid', GRIDS)
+@pytest.mark.parametrize('neigh_radius', [1, 2])
+@pytest.mark.parametrize('vacancy_rate', [0., 0.2])
+def test_count_backends_match_csr(make_grid, grid, neigh_radius, vacancy_rate):
+    # the grid backends (roll stencil, summed-area table) against the CSR neighbourhood
+    env = make_grid(neigh_radius=neigh_radius, vacancy_rate=vacancy_rate, **grid)
+    counts = env._compute_neighborhood_type_matrix()
+    expected = BaseGraphEnvironment._compute_neighborhood_type_matrix(env)
+    assert counts.dtype == expected.dtype
+    np.testing.assert_array_equal(counts, expected)
+
+
+@pytest.mark.parametrize('wrapped_indices', [True, [True, False]])
+def test_kernel_counts_match_csr(make_grid, wrapped_indices):
+    # the FFT convolution against the weighted CSR neighbourhood
+    env = make_grid([10, 9], wrapped_indices=wrapped_indices, vacancy_rate=0.1,
+                    neighbour_kernel=gaussian_kernel(2, 1.5))
+    counts = env._compute_neighborhood_type_matrix()
+    expected = BaseGraphEnvironment._compute_neighborhood_type_matrix(env)
+    np.testing.assert_array_equal(counts, expected)
+
+
+@pytest.mark.parametrize('grid', GRIDS)
+@pytest.mark.parametrize('vacancy_rate', [0., 0.2])
+def test_incremental_counts_match_recompute(make_grid, grid, vacancy_rate):
+    env = make_grid(neigh_radius=2, vacancy_rate=vacancy_rate, **grid)
+    rng = np.random.default_rng(1)
+    env.get_neighborhood_type_matrix()
+    env.get_placement_utility_matrix()
+    for _ in range(50):
+        loc_ids = rng.choice(env.num_vertices, 4, replace=False)
+        env.move_vertices(DynamicsOutput(past_locations=loc_ids,
+                                         new_locations=rng.permutation(loc_ids),
+                                         is_end=False))
+    counts = env.get_neighborhood_type_matrix().copy()
+    placement_utilities = env.get_placement_utility_matrix().copy()
+    world_hash = env.world_hash
+
+    env.world = env.world.copy()
+    np.testing.assert_array_equal(counts, env.get_neighborhood_type_matrix())
+    np.testing.assert_allclose(placement_utilities, env.get_placement_utility_matrix(), equal_nan=True)
+    assert world_hash == env.world_hash
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from dynamics.stability import find_improving_swap, is_stable
+from dynamics.swap import RandomSwapper, UtilityOrderedSwapper, \
+    INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER, COLLECTIVE_GREATER
+from utilities.neighborhood_vector_metrics import EntropyDivertiyUtility, SchellingSegregationUtility, \
+    DifferenceCountDiversityUtility, BinaryDiversityUtility
+
+
+SWAP_CONDS = [INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER, COLLECTIVE_GREATER]
+UTILITIES = [EntropyDivertiyUtility, SchellingSegregationUtility, DifferenceCountDiversityUtility, BinaryDiversityUtility]
+
+
+@pytest.mark.parametrize('swap_cond', SWAP_CONDS)
+@pytest.mark.parametrize('utility', UTILITIES)
+@pytest.mark.parametrize('num_steps', [0, 2000])
+def test_certificate_matches_brute_force(make_grid, brute_force_swaps, swap_cond, utility, num_steps):
+    # on random worlds (many swaps) and on worlds close to (or at) an equilibrium
+    env = make_grid([6, 6], seed=swap_cond, neigh_radius=2, utility=utility(),
+                    dynamics=UtilityOrderedSwapper(swap_cond))
+    for _ in range(num_steps):
+        if not env.step():
+            break
+    accepted = brute_force_swaps(env, RandomSwapper(swap_cond))
+    pair = find_improving_swap(env, swap_cond)
+    if len(accepted) == 0:
+        assert pair is None
+        assert is_stable(env, swap_cond)
+    else:
+        assert pair is not None
+        assert sorted(pair) in accepted.tolist()
+
+
+def test_certificate_of_given_world(make_grid):
+    env = make_grid([6, 6], dynamics=UtilityOrderedSwapper(INDIVIDUAL_GREATER))
+    world, world_hash = env.world.copy(), env.world_hash
+    while env.step():
+        pass
+    final_world = env.world.copy()
+    env.world = world
+    assert is_stable(env, INDIVIDUAL_GREATER, final_world)
+    # env is not modified
+    np.testing.assert_array_equal(env.world, world)
+    assert env.world_hash == world_hash
+
+
+@pytest.mark.parametrize('swap_cond', SWAP_CONDS)
+@pytest.mark.parametrize('utility', UTILITIES)
+@pytest.mark.parametrize('vertex_degree', [4, 8])
+def test_vacancies_match_brute_force(make_grid, brute_force_swaps, swap_cond, utility, vertex_degree):
+    # the EMPTY locations have no utility and do not vote under COLLECTIVE_GREATER
+    env = make_grid([6, 6], seed=swap_cond, vacancy_rate=0.25, vertex_degree=vertex_degree, utility=utility(),
+                    dynamics=RandomSwapper(swap_cond, batch_size=32, seed=0))
+    for num_steps in [0, 300]:
+        for _ in range(num_steps):
+            env.step()
+        accepted = brute_force_swaps(env, env.dynamics)
+        loc_ids1, loc_ids2 = np.triu_indices(env.num_vertices, 1)
+        is_accepted = env.dynamics._accepted_swaps(env, loc_ids1, loc_ids2)
+        np.testing.assert_array_equal(np.stack([loc_ids1, loc_ids2], axis=1)[is_accepted], accepted)
+        pair = find_improving_swap(env, swap_cond)
+        assert (pair is None) == (len(accepted) == 0)
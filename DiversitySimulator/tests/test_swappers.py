@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from dynamics.swap import RandomSwapper, SteepestDescentSwapper, \
+    INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER, COLLECTIVE_GREATER
+from utilities.neighborhood_vector_metrics import SchellingSegregationUtility, DifferenceCountDiversityUtility
+
+
+SWAP_CONDS = [INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER, COLLECTIVE_GREATER]
+
+
+@pytest.mark.parametrize('swap_cond', SWAP_CONDS)
+@pytest.mark.parametrize('vertex_degree', [4, 8])
+def test_batch_random_swapper_matches_scalar(make_grid, swap_cond, vertex_degree):
+    # the same proposals, evaluated one by one with the scalar swap condition
+    batch_size, seed = 64, 3
+    swapper = RandomSwapper(swap_cond, batch_size=batch_size, seed=seed)
+    env = make_grid([8, 8], seed=1, neigh_radius=2, vertex_degree=vertex_degree, dynamics=swapper)
+    reference_env = make_grid([8, 8], seed=1, neigh_radius=2, vertex_degree=vertex_degree)
+    reference = RandomSwapper(swap_cond)
+    rng = np.random.default_rng(seed)
+    for _ in range(4):
+        loc_ids1 = rng.integers(env.num_vertices, size=batch_size)
+        loc_ids2 = rng.integers(env.num_vertices-1, size=batch_size)
+        loc_ids2 += loc_ids2 >= loc_ids1
+        for loc_id1, loc_id2 in zip(loc_ids1.tolist(), loc_ids2.tolist()):
+            v1, v2 = reference_env.get_vertex(loc_id1), reference_env.get_vertex(loc_id2)
+            if v1.type != v2.type and reference._can_swap(v1, v2, reference_env):
+                reference_env.move_vertices(reference._swap(v1, v2))
+        # all the accepted swaps of the batch, then None when it is exhausted
+        while env.step():
+            pass
+        np.testing.assert_array_equal(env.world, reference_env.world)
+
+
+@pytest.mark.parametrize('swap_cond', [INDIVIDUAL_GREATER, INDIVIDUAL_NO_WORSE, SUM_GREATER])
+@pytest.mark.parametrize('grid', [
+    dict(world_size=[8, 8], vertex_degree=4, neigh_radius=2),
+    dict(world_size=[7, 6], vertex_degree=8, wrapped_indices=[False, True]),
+])
+def test_steepest_descent_matches_brute_force(make_grid, brute_force_swaps, swap_cond, grid):
+    swapper = SteepestDescentSwapper(swap_cond, chunk_size=7)
+    env = make_grid(seed=2, utility=SchellingSegregationUtility(), dynamics=swapper, **grid)
+    for _ in range(5):
+        accepted = brute_force_swaps(env, swapper)
+        response = swapper.step(env)
+        if len(accepted) == 0:
+            assert response.is_end
+            break
+        utilities = env.compute_utilities()
+        swapped = []
+        for loc_id1, loc_id2 in accepted:
+            env.move_vertices(swapper._swap(env.get_vertex(loc_id1), env.get_vertex(loc_id2)))
+            u12, u21 = env.compute_utilities(loc_ids=[loc_id2, loc_id1])
+            env.move_vertices(swapper._swap(env.get_vertex(loc_id1), env.get_vertex(loc_id2)))
+            swapped.append((u12, u21))
+        u1, u2 = utilities[accepted[:, 0]], utilities[accepted[:, 1]]
+        u12, u21 = np.array(swapped).T
+        gains = swapper._get_gains(u1, u2, u12, u21)
+        best = accepted[np.flatnonzero(gains == np.max(gains))[0]]
+        assert sorted(response.past_locations.tolist()) == best.tolist()
+        env.move_vertices(response)
+
+
+def test_steepest_descent_rejects_collective():
+    with pytest.raises(ValueError):
+        SteepestDescentSwapper(COLLECTIVE_GREATER)
+
+
+@pytest.mark.parametrize('swap_cond', SWAP_CONDS)
+def test_rejection_free_swaps_can_swap(make_grid, brute_force_swaps, swap_cond):
+    swapper = RandomSwapper(swap_cond, rejection_free=True, seed=0)
+    env = make_grid([6, 6], seed=4, utility=DifferenceCountDiversityUtility(), dynamics=swapper)
+    for _ in range(10):
+        accepted = brute_force_swaps(env, swapper)
+        response = swapper.step(env)
+        if len(accepted) == 0:
+            assert response.is_end
+            break
+        assert sorted(response.past_locations.tolist()) in accepted.tolist()
+        env.move_vertices(response)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from graph_envs.base_graph_env import VertexBlock
+from utilities.base_utility import BaseUtility, EMPTY
+from utilities.neighborhood_vector_metrics import BinaryDiversityUtility, DifferenceCountDiversityUtility, \
+    TypeCountingDiversityUtility, AvgDiffTypeCountingDiversityUtility, SchellingSegregationUtility, \
+    AntiSchellingSegregationUtility, EntropyDivertiyUtility
+
+
+UTILITIES = [BinaryDiversityUtility, DifferenceCountDiversityUtility, TypeCountingDiversityUtility,
+             AvgDiffTypeCountingDiversityUtility, SchellingSegregationUtility,
+             AntiSchellingSegregationUtility, EntropyDivertiyUtility]
+
+
+def _random_counts(num_types: int, degree: int, num_vertices: int = 200, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    types = rng.integers(num_types, size=num_vertices)
+    count_matrix = np.zeros((num_vertices, num_types), dtype=np.uint8)
+    for counts in count_matrix:
+        np.add.at(counts, rng.integers(num_types, size=rng.integers(1, degree+1)), 1)
+    return types, count_matrix
+
+
+@pytest.mark.parametrize('utility', UTILITIES)
+@pytest.mark.parametrize('num_types, degree', [(2, 4), (3, 8), (6, 24)])
+def test_vectorised_batch_matches_scalar(utility, num_types, degree):
+    # the vectorised overrides against the default loop over the scalar methods
+    utility = utility()
+    types, count_matrix = _random_counts(num_types, degree)
+    np.testing.assert_allclose(utility.compute_batch(types, count_matrix),
+                               BaseUtility.compute_batch(utility, types, count_matrix), equal_nan=True)
+    np.testing.assert_allclose(utility.best_case_batch(types, count_matrix),
+                               BaseUtility.best_case_batch(utility, types, count_matrix))
+
+
+class _OwnTypeCountUtility(BaseUtility):
+    '''
+        Only the scalar methods: the batch methods are the default loops.
+    '''
+    def best_case(self, vertex):
+        return np.sum(vertex.neigh_type_vector)
+
+    def compute(self, vertex):
+        return vertex.neigh_type_vector[vertex.type]
+
+
+def test_scalar_only_utility():
+    utility = _OwnTypeCountUtility()
+    types, count_matrix = _random_counts(3, 8)
+    types[::5] = EMPTY
+    block = VertexBlock(loc_idx=np.arange(len(types)), type=types, neigh_type_vector=count_matrix)
+    utilities = utility.compute_block(block)
+    is_occupied = types != EMPTY
+    assert np.all(np.isnan(utilities[~is_occupied]))
+    np.testing.assert_array_equal(utilities[is_occupied],
+                                  count_matrix[np.flatnonzero(is_occupied), types[is_occupied]])
+    np.testing.assert_array_equal(utility.best_case_block(block)[is_occupied],
+                                  np.sum(count_matrix[is_occupied], axis=1))
@@ -4,7 +4,10 @@ import numpy as np
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from graph_envs.base_graph_env import Vertex
+    from graph_envs.base_graph_env import Vertex, VertexBlock
+
+# type of the empty locations (vacancies), which are not counted in the neighbourhood-type vectors
+EMPTY = -1
 
 
 class BaseUtility(ABC):
@@ -18,4 +21,64 @@ class BaseUtility(ABC):
 
     @abstractmethod
     def compute(self, vertex: Vertex):
-        pass
\ No newline at end of file
+        pass
+
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        '''
+            Best case of many vertices at once.
+            By default, `best_case` of each vertex in turn: subclasses override it 
+            with a vectorised version.
+
+            Args:
+                types: np.array of the types of the vertices
+                count_matrix: np.array of shape (len(types), num_types), 
+                              the neighbourhood-type vector of each vertex
+
+            Return:
+                np.array of length len(types)
+        '''
+        return self._apply_each(self.best_case, types, count_matrix)
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        '''
+            Utility of many vertices at once.
+            By default, `compute` of each vertex in turn: subclasses override it 
+            with a vectorised version.
+
+            Args:
+                types: np.array of the types of the vertices
+                count_matrix: np.array of shape (len(types), num_types), 
+                              the neighbourhood-type vector of each vertex
+
+            Return:
+                np.array of length len(types)
+        '''
+        return self._apply_each(self.compute, types, count_matrix)
+
+    def _apply_each(self, func, types: np.ndarray, count_matrix: np.ndarray):
+        '''
+            Apply the scalar func to a Vertex built from each row.
+        '''
+        from graph_envs.base_graph_env import Vertex
+
+        # in float, as the counts may be stored in a narrow unsigned dtype
+        count_matrix = np.asarray(count_matrix, dtype=float)
+        return np.array([func(Vertex(type=int(t), neigh_type_vector=counts)) 
+                         for t, counts in zip(types, count_matrix)], dtype=float)
+
+    def best_case_block(self, block: VertexBlock):
+        return self._compute_occupied(self.best_case_batch, block)
+
+    def compute_block(self, block: VertexBlock):
+        return self._compute_occupied(self.compute_batch, block)
+
+    def _compute_occupied(self, batch_func, block: VertexBlock):
+        '''
+            Apply batch_func to the vertices of the block that are not EMPTY (NaN for the others).
+        '''
+        is_occupied = block.type != EMPTY
+        if np.all(is_occupied):
+            return batch_func(block.type, block.neigh_type_vector)
+        values = np.full(len(block.type), np.nan)
+        values[is_occupied] = batch_func(block.type[is_occupied], block.neigh_type_vector[is_occupied])
+        return values
@@ -0,0 +1,146 @@
+'''
+    Lookup tables for the utilities based on `vertex.neigh_type_vector`.
+    Such a utility (and its best case) only depends on the type of the vertex
+    and on the composition of its neighbourhood, so its values can be
+    computed once per composition and then gathered.
+'''
+from __future__ import annotations
+from collections import OrderedDict
+from itertools import combinations
+from math import comb
+import numpy as np
+
+from utilities.base_utility import BaseUtility
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from graph_envs.base_graph_env import Vertex
+
+
+def get_compositions(num_types: int, max_degree: int):
+    '''
+        Enumerate all the neighbourhood-type vectors of at most max_degree vertices.
+
+        Compositions c with sum(c) <= max_degree are in bijection with the strictly
+        increasing sequences a_k = c_1 + ... + c_k + k - 1 of values in [0, max_degree + num_types).
+
+        Return:
+            np.array of shape (C(max_degree + num_types, num_types), num_types)
+    '''
+    sequences = np.array(list(combinations(range(max_degree + num_types), num_types)), dtype=np.int64)
+    return np.diff(sequences - np.arange(num_types), axis=1, prepend=0)
+
+
+class LookupTableUtility(BaseUtility):
+    '''
+        Memoize a utility by (own type, neighbourhood composition).
+
+        If the neighbourhood-type vectors are integer compositions of at most
+        `max_degree` over `num_types` types and there are at most `max_table_size`
+        (composition, type) pairs, a dense table is built once for every composition
+        and the evaluation is an array gather.
+        Otherwise, the values are kept in a bounded LRU cache.
+        Non-integer neighbourhood-type vectors are passed to the utility as they are.
+    '''
+    def __init__(self, utility: BaseUtility, max_table_size: int = 2**20, cache_size: int = 2**16):
+        '''
+            Args:
+                utility: the utility to memoize
+                max_table_size: max number of entries of the dense tables
+                cache_size: max number of entries of the LRU cache
+        '''
+        self.utility = utility
+        self.max_table_size = max_table_size
+        self.cache_size = cache_size
+        self._num_types = None
+        self._max_degree = -1
+        self._binomials = None
+        self._compute_table = None
+        self._best_case_table = None
+        self._compute_cache = OrderedDict()
+        self._best_case_cache = OrderedDict()
+
+    def best_case(self, vertex: Vertex):
+        return self.best_case_batch(np.array([vertex.type]), vertex.neigh_type_vector[None])[0]
+
+    def compute(self, vertex: Vertex):
+        return self.compute_batch(np.array([vertex.type]), vertex.neigh_type_vector[None])[0]
+
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return self._lookup(types, count_matrix, is_best_case=True)
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return self._lookup(types, count_matrix, is_best_case=False)
+
+    def _evaluate(self, types: np.ndarray, count_matrix: np.ndarray, is_best_case: bool):
+        if is_best_case:
+            return self.utility.best_case_batch(types, count_matrix)
+        return self.utility.compute_batch(types, count_matrix)
+
+    def _lookup(self, types: np.ndarray, count_matrix: np.ndarray, is_best_case: bool):
+        if len(types) == 0 or np.any(count_matrix != np.floor(count_matrix)):
+            return self._evaluate(types, count_matrix, is_best_case)
+        count_matrix = count_matrix.astype(np.int64)
+        num_types = count_matrix.shape[1]
+        max_degree = int(np.max(np.sum(count_matrix, axis=1)))
+        if num_types != self._num_types or max_degree > self._max_degree:
+            self._reset(num_types, max_degree)
+        if self._binomials is None:
+            return self._lookup_cache(types, count_matrix, is_best_case)
+        table = self._best_case_table if is_best_case else self._compute_table
+        return table[self._rank(count_matrix), types]
+
+    def _reset(self, num_types: int, max_degree: int):
+        '''
+            Build the dense tables for compositions of at most max_degree,
+            if they are small enough.
+        '''
+        self._num_types = num_types
+        self._max_degree = max_degree
+        self._compute_cache.clear()
+        self._best_case_cache.clear()
+        self._binomials = self._compute_table = self._best_case_table = None
+        num_compositions = comb(max_degree + num_types, num_types)
+        if num_compositions * num_types > self.max_table_size:
+            return
+
+        # compositions are ranked through their increasing sequences (see `get_compositions`)
+        # with the combinatorial number system: rank = sum_k C(a_k, k)
+        self._binomials = np.array([[comb(a, k+1) for k in range(num_types)] 
+                                    for a in range(max_degree + num_types)], dtype=np.int64)
+        compositions = get_compositions(num_types, max_degree)
+        ranks = self._rank(compositions)
+        compositions = compositions.astype(float)
+
+        self._compute_table = np.zeros((num_compositions, num_types))
+        self._best_case_table = np.zeros((num_compositions, num_types))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for t in range(num_types):
+                types = np.full(len(compositions), t)
+                self._compute_table[ranks, t] = self._evaluate(types, compositions, False)
+                self._best_case_table[ranks, t] = self._evaluate(types, compositions, True)
+
+    def _rank(self, count_matrix: np.ndarray):
+        sequences = np.cumsum(count_matrix, axis=1) + np.arange(count_matrix.shape[1])
+        return np.sum(self._binomials[sequences, np.arange(count_matrix.shape[1])], axis=1)
+
+    def _lookup_cache(self, types: np.ndarray, count_matrix: np.ndarray, is_best_case: bool):
+        cache = self._best_case_cache if is_best_case else self._compute_cache
+        keys = np.column_stack([types, count_matrix])
+        unique_keys, key_idx = np.unique(keys, axis=0, return_inverse=True)
+        values = np.zeros(len(unique_keys))
+        missing = []
+        for i, key in enumerate(map(bytes, unique_keys)):
+            if key in cache:
+                cache.move_to_end(key)
+                values[i] = cache[key]
+            else:
+                missing.append(i)
+        if len(missing) > 0:
+            missing_keys = unique_keys[missing]
+            values[missing] = self._evaluate(missing_keys[:, 0], missing_keys[:, 1:].astype(float),
+                                             is_best_case)
+            for key, value in zip(map(bytes, missing_keys), values[missing].tolist()):
+                cache[key] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return values[key_idx.reshape(-1)]
@@ -6,6 +6,7 @@
 from __future__ import annotations
 import numpy as np
 from scipy.stats import entropy
+from scipy.special import entr
 
 from utilities.base_utility import BaseUtility
 from typing import TYPE_CHECKING
@@ -13,6 +14,13 @@ if TYPE_CHECKING:
     from graph_envs.base_graph_env import Vertex
 
 
+def _own_type_counts(types: np.ndarray, count_matrix: np.ndarray):
+    '''
+        Number of neighbours having the same type as the vertex, for each vertex.
+    '''
+    return count_matrix[np.arange(len(types)), types]
+
+
 class BinaryDiversityUtility(BaseUtility):
     '''
         1 if one of its neighbours is a different type than itself
@@ -26,6 +34,13 @@ class BinaryDiversityUtility(BaseUtility):
             return 0
         return 1
 
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return np.ones(len(types))
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        own_counts = _own_type_counts(types, count_matrix)
+        return (own_counts != np.sum(count_matrix, axis=1)).astype(float)
+
 
 class DifferenceCountDiversityUtility(BaseUtility):
     '''
@@ -43,6 +58,13 @@ class DifferenceCountDiversityUtility(BaseUtility):
             count += c
         return count
 
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return np.sum(count_matrix, axis=1, dtype=float)
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        own_counts = _own_type_counts(types, count_matrix)
+        return np.sum(count_matrix, axis=1, dtype=float) - own_counts
+
 
 class TypeCountingDiversityUtility(BaseUtility):
     '''
@@ -57,6 +79,13 @@ class TypeCountingDiversityUtility(BaseUtility):
         neigh_type_vector[vertex.type] = 0
         return len([i for i in neigh_type_vector if i > 0])
 
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return np.minimum(np.sum(count_matrix, axis=1, dtype=float), count_matrix.shape[1]-1)
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        own_counts = _own_type_counts(types, count_matrix)
+        return (np.count_nonzero(count_matrix > 0, axis=1) - (own_counts > 0)).astype(float)
+
 
 class AvgDiffTypeCountingDiversityUtility(BaseUtility):
     def __init__(self):
@@ -71,6 +100,16 @@ class AvgDiffTypeCountingDiversityUtility(BaseUtility):
                        self._type_u.compute(vertex)/self._type_u.best_case(vertex)])
         return avg
 
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return np.ones(len(types))
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        diff = (self._diff_u.compute_batch(types, count_matrix) / 
+                self._diff_u.best_case_batch(types, count_matrix))
+        type_count = (self._type_u.compute_batch(types, count_matrix) / 
+                      self._type_u.best_case_batch(types, count_matrix))
+        return (diff + type_count)/2
+
 
 class SchellingSegregationUtility(BaseUtility):
     '''
@@ -91,6 +130,15 @@ class SchellingSegregationUtility(BaseUtility):
             return int(utility >= thresh)
         return utility
 
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        return np.ones(len(types))
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray, thresh: float = 0):
+        utility = _own_type_counts(types, count_matrix)/np.sum(count_matrix, axis=1)
+        if thresh > 0:
+            return (utility >= thresh).astype(float)
+        return utility
+
 
 class AntiSchellingSegregationUtility(SchellingSegregationUtility):
     '''
@@ -105,14 +153,23 @@ class AntiSchellingSegregationUtility(SchellingSegregationUtility):
     def compute(self, vertex: Vertex, thresh: float = 0):
         return 1 - super().compute(vertex, thresh)
 
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray, thresh: float = 0):
+        return 1 - super().compute_batch(types, count_matrix, thresh)
+
 
 class EntropyDivertiyUtility(BaseUtility):
     '''
         The entropy of the neighbours type distribution.
     '''
     def best_case(self, vertex: Vertex):
-        num_types = len(vertex.neigh_type_vector)
-        graph_degree = int(np.sum(vertex.neigh_type_vector) + 1)
+        return self._best_case(len(vertex.neigh_type_vector), 
+                               int(np.sum(vertex.neigh_type_vector) + 1))
+
+    def _best_case(self, num_types: int, graph_degree: int):
+        '''
+            Entropy of the most even distribution of graph_degree vertices 
+            (including itself) over num_types types.
+        '''
         best_vector = np.ones(min(num_types, graph_degree))
         j = 0
         for i in range(graph_degree - len(best_vector)):
@@ -126,18 +183,84 @@ class EntropyDivertiyUtility(BaseUtility):
         # return np.log(len(vertex.neigh_type_vector))
 
     def compute(self, vertex: Vertex):
-        neigh_type_vector = np.copy(vertex.neigh_type_vector)
-        neigh_type_vector[vertex.type] += 1
-
-        num_types = len(vertex.neigh_type_vector)
-        graph_degree = np.sum(vertex.neigh_type_vector)
-        if graph_degree + 1 < num_types:
-            to_remove = int(num_types - graph_degree - 1)
-            neigh_type_vector = np.sort(neigh_type_vector)
-            assert(np.sum(neigh_type_vector[:to_remove]) == 0, 
-                    'Invalid entropy computation. %s type=%d, degree=%d' % (
-                        str(vertex), num_types, graph_degree))
-            neigh_type_vector = neigh_type_vector[to_remove:]
-        
-        q = neigh_type_vector / np.sum(neigh_type_vector)
-        return entropy(q)
+        return self.compute_batch(np.array([vertex.type]), vertex.neigh_type_vector[None])[0]
+
+    def _best_case_fractional(self, num_types: int, total: np.ndarray):
+        '''
+            Entropy of the most even distribution of a total weight (including 
+            the weight 1 of the vertex itself) over num_types types: uniform 
+            if every type can have at least the weight 1 of the vertex, 
+            otherwise the weight 1 on its type and the rest spread over the others.
+        '''
+        rest = np.maximum(total - 1, 0)[:, None] / max(num_types - 1, 1)
+        q = np.concatenate([np.ones((len(total), 1)), np.repeat(rest, num_types - 1, axis=1)], axis=1)
+        return np.where(total >= num_types, np.log(num_types), entropy(q, axis=1))
+
+    def best_case_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        totals = np.sum(count_matrix, axis=1, dtype=float) + 1
+        best_cases = np.zeros(len(types))
+        # weighted neighbourhoods have fractional totals
+        is_integer = totals == np.floor(totals)
+        if not np.all(is_integer):
+            best_cases[~is_integer] = self._best_case_fractional(count_matrix.shape[1], totals[~is_integer])
+        unique_degrees, degree_idx = np.unique(totals[is_integer].astype(int), return_inverse=True)
+        if len(unique_degrees) > 0:
+            best_cases[is_integer] = np.array([self._best_case(count_matrix.shape[1], graph_degree) 
+                                               for graph_degree in unique_degrees.tolist()])[degree_idx]
+        return best_cases
+
+    def _get_entropy_tables(self, max_count: int):
+        '''
+            Tables of q[S, c] = c / S and entr(q[S, c]) = -q log(q) 
+            over the integer counts 0 <= c <= S <= max_count.
+        '''
+        tables = getattr(self, '_entropy_tables', None)
+        if tables is None or len(tables[0]) <= max_count:
+            counts = np.arange(max(max_count, 1) + 1, dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                q_table = counts[None, :] / counts[:, None]
+            q_table[0] = 0
+            tables = (q_table, entr(q_table))
+            self._entropy_tables = tables
+        return tables
+
+    def compute_batch(self, types: np.ndarray, count_matrix: np.ndarray):
+        neigh_type_matrix = np.array(count_matrix, dtype=float)
+        neigh_type_matrix[np.arange(len(types)), types] += 1
+
+        num_types = count_matrix.shape[1]
+        # summed in float, as the counts may be unsigned integers
+        graph_degrees = np.sum(count_matrix, axis=1, dtype=float)
+        # vertices with fewer neighbours than types are evaluated on 
+        # their (graph_degree + 1) largest counts 
+        # (a fractional, weighted graph_degree is not a number of neighbours)
+        to_remove = np.maximum(num_types - graph_degrees - 1, 0).astype(int)
+        to_remove[graph_degrees != np.floor(graph_degrees)] = 0
+        utilities = np.zeros(len(types))
+        if len(types) == 0:
+            return utilities
+        is_integer = np.all(neigh_type_matrix == np.floor(neigh_type_matrix))
+        if is_integer:
+            neigh_type_matrix = neigh_type_matrix.astype(np.int64)
+            totals = np.sum(neigh_type_matrix, axis=1)
+            q_table, entr_table = self._get_entropy_tables(int(np.max(totals)))
+        for r in np.unique(to_remove).tolist():
+            rows = to_remove == r
+            neigh_type_vectors = neigh_type_matrix[rows]
+            if r > 0:
+                neigh_type_vectors = np.ascontiguousarray(np.sort(neigh_type_vectors, axis=1)[:, r:])
+            if not is_integer:
+                q = neigh_type_vectors / np.sum(neigh_type_vectors, axis=1, keepdims=True)
+                utilities[rows] = entropy(q, axis=1)
+                continue
+            # same operations as `scipy.stats.entropy(c / S)`, with the
+            # table lookups standing in for rows whose q already sums to 1
+            row_totals = totals[rows][:, None]
+            q = q_table[row_totals, neigh_type_vectors]
+            q_sums = np.sum(q, axis=1)
+            entr_vectors = entr_table[row_totals, neigh_type_vectors]
+            renormalize = q_sums != 1
+            if np.any(renormalize):
+                entr_vectors[renormalize] = entr(q[renormalize] / q_sums[renormalize, None])
+            utilities[rows] = np.sum(entr_vectors, axis=1)
+        return utilities